@@ -0,0 +1,38 @@
+"""
+Compare the per-call cost of ``get_user_model()`` with and without the cached
+user model.
+
+Usage:
+
+    python benchmarks/get_user_model.py
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    'DJANGO_SETTINGS_MODULE', 'polymorphic_auth.tests.settings')
+
+import django
+django.setup()
+
+from polymorphic_auth import monkey
+
+NUMBER = 100000
+
+
+def main():
+    for label, func in (
+            ('uncached', monkey._resolve_user_model),
+            ('cached', monkey._get_user_model)):
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=5))
+        print('%-10s %8.3f us/call' % (label, seconds / NUMBER * 1e6))
+
+
+if __name__ == '__main__':
+    main()
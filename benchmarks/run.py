@@ -0,0 +1,133 @@
+"""
+Measure query counts and latency for login, user creation and admin hot paths
+with synthetic data sets of users split between ``EmailUser`` and
+``UsernameUser``.
+
+Usage:
+
+    python benchmarks/run.py [--users 10000,100000,1000000] [--number 100]
+
+Set ``BENCHMARK_DATABASE`` to a file path to use an SQLite database file
+instead of an in-memory database.
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(
+    0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+django.setup()
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from polymorphic_auth.models import User
+from polymorphic_auth.usertypes.email.models import EmailUser
+from polymorphic_auth.usertypes.username.models import UsernameUser
+
+SAMPLE_SIZE = 100
+
+
+def seed(count):
+    """
+    Replace all users with ``count`` users, half of each type, with unusable
+    passwords.
+    """
+    # Delete rows directly, child tables first, to avoid loading them all.
+    with connection.cursor() as cursor:
+        for model in (EmailUser, UsernameUser, User):
+            cursor.execute(
+                'DELETE FROM %s' % connection.ops.quote_name(
+                    model._meta.db_table))
+    half = count // 2
+    EmailUser.objects.bulk_create_users(
+        {'email': 'user%d@example.com' % i} for i in range(half))
+    UsernameUser.objects.bulk_create_users(
+        {'username': 'user%d' % i, 'email': 'user%d@example.org' % i}
+        for i in range(count - half))
+    admin_user = EmailUser.objects.create(
+        email='admin@example.com', is_staff=True, is_superuser=True)
+    return admin_user
+
+
+def get_operations(count, admin_user):
+    """
+    Return a list of ``(name, func)`` tuples for operations to measure.
+    """
+    emails = ['user%d@example.com' % random.randrange(count // 2)
+              for i in range(SAMPLE_SIZE)]
+    existing = EmailUser.objects.get_by_natural_key(emails[0])
+    pks = list(User.objects.non_polymorphic().order_by('?')
+               .values_list('pk', flat=True)[:SAMPLE_SIZE])
+    devnull = open(os.devnull, 'w')
+    request = RequestFactory().get('/admin/polymorphic_auth/user/')
+    request.user = admin_user
+    user_admin = admin.site._registry[User]
+    created = itertools.count()
+
+    def get_by_natural_key():
+        EmailUser.objects.get_by_natural_key(random.choice(emails))
+
+    def save():
+        existing.save()
+
+    def try_create_existing():
+        EmailUser.try_create(email=existing.email, _stdout=devnull)
+
+    def try_create_new():
+        EmailUser.try_create(
+            email='new%d@example.com' % next(created),
+            _unusable_password=True, _stdout=devnull)
+
+    def upcast():
+        list(User.objects.filter(pk__in=pks))
+
+    def changelist():
+        user_admin.changelist_view(request).render()
+
+    return [
+        ('get_by_natural_key', get_by_natural_key),
+        ('save', save),
+        ('try_create (existing)', try_create_existing),
+        ('try_create (new)', try_create_new),
+        ('upcast %d users' % SAMPLE_SIZE, upcast),
+        ('admin changelist', changelist),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--users', default='10000,100000',
+        help='Comma separated list of data set sizes. Default: 10000,100000')
+    parser.add_argument(
+        '--number', default=100, type=int,
+        help='Number of calls to time for each operation. Default: 100')
+    args = parser.parse_args()
+
+    call_command('migrate', interactive=False, verbosity=0)
+    print('%-24s %10s %8s %12s' % ('operation', 'users', 'queries', 'ms/call'))
+    for count in [int(size) for size in args.users.split(',')]:
+        admin_user = seed(count)
+        for name, func in get_operations(count, admin_user):
+            with CaptureQueriesContext(connection) as queries:
+                func()
+            seconds = min(timeit.repeat(func, number=args.number, repeat=3))
+            print('%-24s %10d %8d %12.3f' % (
+                name, count, len(queries), seconds / args.number * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+Settings for the benchmarks, with both bundled user types installed.
+"""
+
+import os
+
+from polymorphic_auth.tests.settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('BENCHMARK_DATABASE', ':memory:'),
+    }
+}
+
+DEBUG = False
+
+INSTALLED_APPS += (
+    'polymorphic_auth.usertypes.username',
+)
+
+if os.environ.get('BENCHMARK_LAZY_PLUGINS'):
+    # Declare plugin modules, and don't autodiscover admin modules (as in a
+    # worker process that never uses the admin).
+    INSTALLED_APPS = tuple(
+        'django.contrib.admin.apps.SimpleAdminConfig'
+        if app == 'django.contrib.admin' else app
+        for app in INSTALLED_APPS)
+    POLYMORPHIC_AUTH = dict(POLYMORPHIC_AUTH, PLUGINS=[
+        'polymorphic_auth.usertypes.email.polymorphic_auth_plugins',
+        'polymorphic_auth.usertypes.username.polymorphic_auth_plugins',
+    ])
@@ -0,0 +1,62 @@
+"""
+Compare the time taken by ``django.setup()`` and the number of modules it
+imports, with plugin autodiscovery and with declared plugin modules
+(``POLYMORPHIC_AUTH['PLUGINS']``) and admin autodiscovery disabled.
+
+Each measurement runs in a new process, so imports are not cached.
+
+Usage:
+
+    python benchmarks/startup.py [--repeat 10]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = '''
+import json, sys, time
+start = time.time()
+import django
+django.setup()
+print(json.dumps({
+    'seconds': time.time() - start,
+    'modules': len(sys.modules),
+    'admin': 'polymorphic_auth.admin' in sys.modules,
+}))
+'''
+
+
+def measure(lazy):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='benchmarks.settings')
+    env.pop('BENCHMARK_LAZY_PLUGINS', None)
+    if lazy:
+        env['BENCHMARK_LAZY_PLUGINS'] = '1'
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT], cwd=ROOT, env=env)
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--repeat', default=10, type=int,
+        help='Number of processes to start for each mode. Default: 10')
+    args = parser.parse_args()
+
+    print('%-12s %12s %8s %14s' % ('mode', 'ms', 'modules', 'admin imported'))
+    for label, lazy in (('autodiscover', False), ('lazy', True)):
+        results = [measure(lazy) for i in range(args.repeat)]
+        best = min(results, key=lambda result: result['seconds'])
+        print('%-12s %12.1f %8d %14s' % (
+            label, best['seconds'] * 1e3, best['modules'], best['admin']))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,11 +4,37 @@ from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.contrib.auth.forms import \
     ReadOnlyPasswordHashField, UserChangeForm as DjangoUserChangeForm, \
     UserCreationForm
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import F
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Coalesce
+from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 from polymorphic_auth.models import User
 from polymorphic.admin import \
     PolymorphicParentModelAdmin, PolymorphicChildModelAdmin
-from polymorphic_auth import plugins
+from polymorphic_auth import appsettings, pagination, plugins, search
+from polymorphic_auth.instrumentation import instrumented
+
+
+class KeysetPaginationMixin(object):
+    """
+    Use ``KeysetPaginator`` and skip the full result count when the
+    ``ADMIN_KEYSET_PAGINATION`` setting is enabled.
+    """
+
+    @property
+    def show_full_result_count(self):
+        return not appsettings.ADMIN_KEYSET_PAGINATION
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        if appsettings.ADMIN_KEYSET_PAGINATION:
+            return pagination.KeysetPaginator(
+                queryset, per_page, orphans, allow_empty_first_page)
+        return super(KeysetPaginationMixin, self).get_paginator(
+            request, queryset, per_page, orphans, allow_empty_first_page)
 
 
 class ChildModelPluginPolymorphicParentModelAdmin(PolymorphicParentModelAdmin):
@@ -19,6 +45,7 @@ class ChildModelPluginPolymorphicParentModelAdmin(PolymorphicParentModelAdmin):
     child_model_plugin_class = None
     child_model_admin = None
 
+    @instrumented('get_child_models')
     def get_child_models(self):
         """
         Get child models from registered plugins. Fallback to the child model
@@ -27,7 +54,7 @@ class ChildModelPluginPolymorphicParentModelAdmin(PolymorphicParentModelAdmin):
         child_models = []
         for plugin in self.child_model_plugin_class.get_plugins():
             child_models.append(
-                (plugin.model, plugin.model_admin))
+                (plugin.model, plugin.get_model_admin()))
 
         if not child_models:
             child_models.append((
@@ -44,17 +71,37 @@ class ChildModelPluginPolymorphicParentModelAdmin(PolymorphicParentModelAdmin):
         choices = super(ChildModelPluginPolymorphicParentModelAdmin, self) \
             .get_child_type_choices(request, action)
         # Update label with verbose name from plugins.
-        plugins = self.child_model_plugin_class.get_plugins()
+        plugins = self.child_model_plugin_class.get_plugins_by_content_type()
         if plugins:
-            labels = {
-                plugin.content_type.pk: plugin.verbose_name
-                for plugin in plugins
-            }
-            choices = [(ctype, labels[ctype]) for ctype, _ in choices]
+            choices = [
+                (ctype, plugins[ctype].verbose_name) for ctype, _ in choices]
             return sorted(choices, key=lambda i: i[1])
         return choices
 
 
+def _lookup_needs_distinct(opts, lookup_path):
+    """
+    Return ``True`` if a search on ``lookup_path`` traverses a many-valued
+    relation at any step, and so could return duplicate rows.
+    """
+    # Strip `search_fields` prefixes, e.g. `^name` or `=email`.
+    lookup_path = lookup_path.lstrip('^=@')
+    for field_name in lookup_path.split(LOOKUP_SEP):
+        try:
+            field = opts.get_field(field_name)
+        except FieldDoesNotExist:
+            # A lookup or transform, e.g. `iexact`.
+            break
+        if not hasattr(field, 'get_path_info'):
+            break
+        path_info = field.get_path_info()
+        if any(path.m2m for path in path_info):
+            return True
+        opts = path_info[-1].to_opts
+    return False
+
+
+@instrumented('check_username_clash')
 def _check_for_username_case_insensitive_clash(form):
     """
     Check for potential duplicate users before save for user types with
@@ -63,20 +110,31 @@ def _check_for_username_case_insensitive_clash(form):
     user = form.instance
     if user and user.IS_USERNAME_CASE_INSENSITIVE:
         username = form.cleaned_data[user.USERNAME_FIELD]
-        matching_users = type(user).objects.filter(**{
-            '%s__iexact' % user.USERNAME_FIELD: username,
-        })
+        matching_users = type(user).objects.filter(
+            **user.get_username_filter(username))
         if user.pk:
             matching_users = matching_users.exclude(pk=user.pk)
-        if matching_users:
+        if matching_users.exists():
             raise forms.ValidationError(
                 u"A user with that %s already exists." % user.USERNAME_FIELD)
 
 
+# Creation form classes, keyed by `(user_model, user_model_fields)`.
+_creation_forms = {}
+
+
 def create_user_creation_form(user_model, user_model_fields):
     """
-    Creates a creation form for the user model and model fields.
+    Returns a creation form for the user model and model fields. Form classes
+    are created once and reused.
     """
+    key = (user_model, tuple(user_model_fields))
+    if key not in _creation_forms:
+        _creation_forms[key] = _create_user_creation_form(*key)
+    return _creation_forms[key]
+
+
+def _create_user_creation_form(user_model, user_model_fields):
     class _UserCreationForm(forms.ModelForm):
         """
         ``UserCreationForm`` without username field hardcoded for backward
@@ -169,7 +227,7 @@ class UserChangeForm(DjangoUserChangeForm):
         _check_for_username_case_insensitive_clash(self)
 
 
-class UserChildAdmin(PolymorphicChildModelAdmin):
+class UserChildAdmin(KeysetPaginationMixin, PolymorphicChildModelAdmin):
     base_fieldsets = (
         ('Meta', {
             'classes': ('collapse', ),
@@ -185,29 +243,34 @@ class UserChildAdmin(PolymorphicChildModelAdmin):
     base_model = User
     filter_horizontal = ('groups', 'user_permissions',)
 
-    def __init__(self, *args, **kwargs):
-        super(UserChildAdmin, self).__init__(*args, **kwargs)
-        self.orig_base_fieldsets = self.base_fieldsets
+    def get_fieldsets(self, request, obj=None):
+        """
+        Ignore ``base_fieldsets`` during user creation, and use the fields from
+        the creation form.
+        """
+        if obj is None:
+            return super(PolymorphicChildModelAdmin, self).get_fieldsets(
+                request, obj)
+        return super(UserChildAdmin, self).get_fieldsets(request, obj)
 
     def get_form(self, request, obj=None, **kwargs):
         """
         Use special form during user creation
         """
         defaults = {}
-        # If an object has not yet been created we can ignorethe base_fieldsets and use a form
-        # designed for user creation. This emulated the behaviour of the django user creation
+        # If an object has not yet been created we use a form designed for user
+        # creation. This emulates the behaviour of the django user creation
         # process.
         if obj is None:
-            self.base_fieldsets = None
-            defaults['form'] = create_user_creation_form(self.model, (self.model.USERNAME_FIELD, ))
-        else:
-            # restore original base fieldsets
-            self.base_fieldsets = self.orig_base_fieldsets
+            defaults['form'] = create_user_creation_form(
+                self.model, (self.model.USERNAME_FIELD, ))
         defaults.update(kwargs)
         return super(UserChildAdmin, self).get_form(request, obj, **defaults)
 
 
-class UserAdmin(ChildModelPluginPolymorphicParentModelAdmin, DjangoUserAdmin):
+class UserAdmin(
+        KeysetPaginationMixin, ChildModelPluginPolymorphicParentModelAdmin,
+        DjangoUserAdmin):
     base_model = User
     child_model_plugin_class = plugins.PolymorphicAuthChildModelPlugin
     child_model_admin = UserChildAdmin
@@ -219,6 +282,61 @@ class UserAdmin(ChildModelPluginPolymorphicParentModelAdmin, DjangoUserAdmin):
     polymorphic_list = True
     ordering = (base_model.USERNAME_FIELD,)
 
+    # Annotate the username from each child model table onto the changelist
+    # query, instead of upcasting every row to display `__str__`.
+    annotate_username = False
+
+    def get_username_lookups(self):
+        """
+        Return `modelname__field` lookups for the `USERNAME_FIELD` of child
+        models that define their own username field.
+        """
+        lookups = []
+        for model, modeladmin in self.get_child_models():
+            try:
+                field = model._meta.get_field(model.USERNAME_FIELD)
+            except (AttributeError, FieldDoesNotExist):
+                continue
+            if field.model is not self.base_model:
+                lookups.append('%s__%s' % (
+                    model._meta.model_name, model.USERNAME_FIELD))
+        return lookups
+
+    def get_queryset(self, request):
+        """
+        Annotate `_username` and skip polymorphic upcasting, if enabled.
+        """
+        queryset = super(UserAdmin, self).get_queryset(request)
+        if not self.annotate_username:
+            return queryset
+        queryset = queryset.non_polymorphic()
+        lookups = self.get_username_lookups()
+        if len(lookups) > 1:
+            queryset = queryset.annotate(_username=Coalesce(
+                *lookups, output_field=models.CharField()))
+        elif lookups:
+            queryset = queryset.annotate(_username=F(lookups[0]))
+        return queryset
+
+    def get_list_display(self, request):
+        """
+        Display the annotated username instead of `__str__`, if enabled.
+        """
+        list_display = super(UserAdmin, self).get_list_display(request)
+        if self.annotate_username:
+            list_display = tuple(
+                'username_display' if field == '__str__' else field
+                for field in list_display)
+        return list_display
+
+    def username_display(self, obj):
+        username = getattr(obj, '_username', None)
+        if username is None:
+            return six.text_type(obj)
+        return username
+    username_display.short_description = _('user')
+    username_display.admin_order_field = '_username'
+
     def get_search_fields(self, request):
         """
         Append `modelname__field` to the list of fields to search based on the
@@ -236,13 +354,23 @@ class UserAdmin(ChildModelPluginPolymorphicParentModelAdmin, DjangoUserAdmin):
                 pass
         return self.search_fields + tuple(additional_fields)
 
-    def get_search_results(self, *args, **kwargs):
-        queryset, use_distinct = super(UserAdmin, self).get_search_results(*args, **kwargs)
-        return queryset, any(
-            '__' in field
-            for model, modeladmin in self.get_child_models()
-            for field in modeladmin.search_fields
-        )
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Only use `DISTINCT` when a search field traverses a many-valued
+        relation. Reverse one-to-one relations to child models don't.
+
+        Search the single search entry table instead, if the
+        ``ADMIN_SEARCH_INDEX`` setting is enabled.
+        """
+        if appsettings.ADMIN_SEARCH_INDEX and search_term:
+            return search.search(queryset, search_term), False
+        queryset, use_distinct = super(UserAdmin, self).get_search_results(
+            request, queryset, search_term)
+        if search_term and not use_distinct:
+            use_distinct = any(
+                _lookup_needs_distinct(self.model._meta, field)
+                for field in self.get_search_fields(request))
+        return queryset, use_distinct
 
 
 
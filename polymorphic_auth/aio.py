@@ -0,0 +1,124 @@
+"""
+Asyncio counterparts of ``UserManager`` and ``AbstractUser`` methods, for use
+in async views. Requires Python 3.5+.
+
+Django has no async ORM interface, so queries run in a bounded thread pool
+executor. Password hashing runs in a separate bounded executor, so a burst of
+logins can't block the event loop or use up the threads available for queries.
+"""
+
+import asyncio
+import functools
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.db import close_old_connections
+
+from polymorphic_auth import appsettings
+
+# Executors, created on first use.
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """
+    Return the ``'db'`` or ``'hashing'`` executor.
+    """
+    with _executors_lock:
+        if name not in _executors:
+            workers = {
+                'db': appsettings.ASYNC_DB_THREADS,
+                'hashing': appsettings.ASYNC_HASHING_THREADS,
+            }[name]
+            _executors[name] = ThreadPoolExecutor(max_workers=workers)
+        return _executors[name]
+
+
+def _call_with_connections(func):
+    """
+    Call ``func`` in a database executor thread. Like Django does for each
+    request, close connections that are unusable or older than
+    ``CONN_MAX_AGE`` before and after.
+    """
+    close_old_connections()
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+async def run_in_executor(name, func, *args, **kwargs):
+    """
+    Call ``func`` in the named executor and return its result.
+    """
+    # Python < 3.7 has no `get_running_loop()`. In a coroutine,
+    # `get_event_loop()` returns the running loop.
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    func = functools.partial(func, *args, **kwargs)
+    if name == 'db':
+        func = functools.partial(_call_with_connections, func)
+    return await loop.run_in_executor(get_executor(name), func)
+
+
+async def get_by_natural_key(manager, username):
+    """
+    Return the concrete child model instance for ``username``.
+    """
+    return await run_in_executor('db', manager.get_by_natural_key, username)
+
+
+async def create_user(manager, password, **extra_fields):
+    """
+    Hash ``password`` in the hashing executor, then save a new user in the
+    database executor.
+    """
+    encoded = await run_in_executor('hashing', make_password, password)
+
+    def create():
+        user = manager.model(**extra_fields)
+        user.password = encoded
+        user.save(using=manager._db)
+        return user
+
+    return await run_in_executor('db', create)
+
+
+async def try_create(model, **kwargs):
+    """
+    Like ``AbstractUser.try_create()``, but the password for a new user is
+    generated and hashed in the hashing executor.
+
+    If the username is derived from other fields by an overridden
+    ``try_create()``, it is not known in advance, so ``try_create()`` checks
+    for an existing user and hashes the password in the database executor.
+    """
+    username = kwargs.get(model.USERNAME_FIELD)
+    if username is None:
+        return await run_in_executor('db', model.try_create, **kwargs)
+    # Check for an existing user first, to avoid hashing a password that won't
+    # be used.
+    user = await run_in_executor(
+        'db', model.objects.filter(**{model.USERNAME_FIELD: username}).first)
+    if user is not None:
+        return user, False
+    if not kwargs.get('_unusable_password') \
+            and not kwargs.get('_defer_hashing'):
+        if 'password' not in kwargs:
+            kwargs['password'] = model.objects.make_random_password(
+                length=random.randint(19, 28))
+        if kwargs['password'] is not None:
+            kwargs['_encoded_password'] = await run_in_executor(
+                'hashing', make_password, kwargs['password'])
+    return await run_in_executor('db', model.try_create, **kwargs)
+
+
+async def check_user_password(user, raw_password):
+    """
+    Check ``raw_password`` against the password for ``user`` in the hashing
+    executor.
+    """
+    return await run_in_executor(
+        'hashing', check_password, raw_password, user.password)
@@ -1,19 +1,30 @@
 from django.apps import AppConfig
 from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
 from django.db.models.signals import post_migrate
 from django.utils.module_loading import autodiscover_modules
 
-from polymorphic_auth import monkey
+from polymorphic_auth import appsettings, monkey
 
 
 def create_users(sender, **kwargs):
     """
     Creates a user account for each name and email in the ``ADMINS`` and
     ``MANAGERS`` settings, skipping duplicates.
+
+    Existing users are found with a single query and skipped without calling
+    ``try_create()``, and missing users are created in a single transaction.
     """
     from django.contrib.auth import get_user_model
+    if not appsettings.CREATE_USERS_ON_MIGRATE:
+        return
     User = get_user_model()
+    if appsettings.CREATE_USERS_ON_MIGRATE == 'changed' and \
+            not _user_migrations_applied(User, kwargs.get('plan')):
+        return
     seen = set()
+    users = []
 
     def create(name, email, fields):
         # Use an incrementing integer as the username for user models with "id"
@@ -21,7 +32,7 @@ def create_users(sender, **kwargs):
         if User.USERNAME_FIELD == 'id':
             seen.add((name, email))
             fields.update(id=len(seen))
-        User.try_create(**fields)
+        users.append(fields)
 
     # Admins.
     for name, email in settings.ADMINS:
@@ -33,15 +44,68 @@ def create_users(sender, **kwargs):
         fields = dict(name=name, email=email, is_staff=True)
         create(name, email, fields)
 
+    # Usernames derived by `try_create()` are not known in advance. Those
+    # users are always passed to `try_create()`, which skips existing users.
+    existing = User.objects.get_existing_usernames(
+        fields[User.USERNAME_FIELD] for fields in users
+        if User.USERNAME_FIELD in fields)
+    with transaction.atomic():
+        for fields in users:
+            if User.USERNAME_FIELD in fields:
+                key = User.objects.get_username_key(
+                    fields[User.USERNAME_FIELD])
+                if key in existing:
+                    continue
+                existing.add(key)
+            User.try_create(**fields)
+
+
+def _user_migrations_applied(User, plan):
+    """
+    Return ``True`` if the migration plan includes migrations for the parent
+    user model, the default child model or any plugin model, or if the plan
+    is not known.
+    """
+    if plan is None:
+        return True
+    from polymorphic_auth.models import User as ParentUser
+    from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+    app_labels = set([ParentUser._meta.app_label, User._meta.app_label])
+    app_labels.update(
+        plugin.model._meta.app_label
+        for plugin in PolymorphicAuthChildModelPlugin.get_plugins())
+    return any(
+        migration.app_label in app_labels for migration, backwards in plan)
+
 
 class AppConfig(AppConfig):
     """
-    Connect ``post_migrate`` signal.
+    Connect ``post_migrate`` and ``user_logged_in`` signals.
     """
     name = 'polymorphic_auth'
     verbose_name = "Polymorphic Authentication and Authorization"
 
     def ready(self):
+        # Patch before `django.contrib.auth.backends` is imported, which binds
+        # `get_user_model` at import time.
         monkey.patch_get_user_model()
+        from polymorphic_auth import backends
         post_migrate.connect(create_users, sender=self)
-        autodiscover_modules('polymorphic_auth_plugins')
+        user_logged_in.connect(
+            backends.store_content_type_in_session,
+            dispatch_uid='polymorphic_auth.store_content_type_in_session')
+        if appsettings.PLUGINS is None:
+            autodiscover_modules('polymorphic_auth_plugins')
+        else:
+            from polymorphic_auth.plugins import \
+                PolymorphicAuthChildModelPlugin
+            PolymorphicAuthChildModelPlugin.add_plugin_modules(
+                *appsettings.PLUGINS)
+        if appsettings.USER_CACHE or appsettings.PERMISSION_CACHE:
+            backends.caching.connect_signals()
+        if appsettings.ADMIN_SEARCH_INDEX:
+            from polymorphic_auth import search
+            search.connect_signals()
+        if appsettings.LAST_LOGIN_BUFFER:
+            from polymorphic_auth import last_login
+            last_login.connect_signals()
@@ -6,3 +6,90 @@ POLYMORPHIC_AUTH = getattr(settings, 'POLYMORPHIC_AUTH', {})
 # should always be set to the polymorphic parent model.
 DEFAULT_CHILD_MODEL = POLYMORPHIC_AUTH.get(
     'DEFAULT_CHILD_MODEL', settings.AUTH_USER_MODEL)
+
+# Alias of a cache in the `CACHES` setting, for user objects loaded by
+# `PolymorphicModelBackend`. `None` disables the cache.
+USER_CACHE = POLYMORPHIC_AUTH.get('USER_CACHE')
+
+# Maximum number of seconds a user object can stay in the cache. Changes made
+# without sending `post_save` (e.g. `QuerySet.update()`) are seen after this.
+USER_CACHE_TIMEOUT = POLYMORPHIC_AUTH.get('USER_CACHE_TIMEOUT', 300)
+
+# Alias of a cache in the `CACHES` setting, for the permissions of users
+# checked by `PolymorphicModelBackend`. `None` disables the cache.
+PERMISSION_CACHE = POLYMORPHIC_AUTH.get('PERMISSION_CACHE')
+
+# Maximum number of seconds permissions can stay in the cache.
+PERMISSION_CACHE_TIMEOUT = POLYMORPHIC_AUTH.get(
+    'PERMISSION_CACHE_TIMEOUT', 300)
+
+# Create accounts for `ADMINS` and `MANAGERS` on `post_migrate`. `True` to run
+# on every migrate, `False` to disable, or `'changed'` to run only when
+# migrations for the user model apps were applied (Django 1.10+).
+CREATE_USERS_ON_MIGRATE = POLYMORPHIC_AUTH.get(
+    'CREATE_USERS_ON_MIGRATE', True)
+
+# Number of threads used to hash passwords for users created with
+# `try_create(_defer_hashing=True)` and to upgrade queued password hashes.
+DEFERRED_HASHING_THREADS = POLYMORPHIC_AUTH.get('DEFERRED_HASHING_THREADS', 2)
+
+# Number of threads used by the asyncio methods (e.g. `aget_by_natural_key()`)
+# to run queries and hash passwords. See `polymorphic_auth.aio`.
+ASYNC_DB_THREADS = POLYMORPHIC_AUTH.get('ASYNC_DB_THREADS', 4)
+ASYNC_HASHING_THREADS = POLYMORPHIC_AUTH.get('ASYNC_HASHING_THREADS', 2)
+
+# Use `polymorphic_auth.pagination.KeysetPaginator` in the user admin, and skip
+# the count of all users shown next to the count of filtered users.
+ADMIN_KEYSET_PAGINATION = POLYMORPHIC_AUTH.get(
+    'ADMIN_KEYSET_PAGINATION', False)
+
+# Minimum estimated number of rows before the estimate is shown instead of an
+# exact count, for databases that provide estimates (PostgreSQL and MySQL).
+ADMIN_ESTIMATED_COUNT_THRESHOLD = POLYMORPHIC_AUTH.get(
+    'ADMIN_ESTIMATED_COUNT_THRESHOLD', 10000)
+
+# Alias of a cache in the `CACHES` setting, for the ordering field values at
+# the start of each changelist page, and how long to keep them.
+ADMIN_PAGINATION_CACHE = POLYMORPHIC_AUTH.get(
+    'ADMIN_PAGINATION_CACHE', 'default')
+ADMIN_PAGINATION_CACHE_TIMEOUT = POLYMORPHIC_AUTH.get(
+    'ADMIN_PAGINATION_CACHE_TIMEOUT', 300)
+
+# Search users in the admin with `polymorphic_auth.search`, which keeps the
+# searchable fields of every user type in a single table. Run the
+# `rebuild_user_search_index` management command after enabling.
+ADMIN_SEARCH_INDEX = POLYMORPHIC_AUTH.get('ADMIN_SEARCH_INDEX', False)
+
+# Callable or dotted path to a callable that is called with the name, duration
+# in seconds and number of queries (or `None`) of each instrumented operation.
+# See `polymorphic_auth.instrumentation`.
+METRICS_CALLBACK = POLYMORPHIC_AUTH.get('METRICS_CALLBACK')
+
+# Dotted paths of modules that register plugins. When set, plugin modules are
+# imported on first use instead of discovering `polymorphic_auth_plugins`
+# modules in every installed app at startup.
+PLUGINS = POLYMORPHIC_AUTH.get('PLUGINS')
+
+# Buffer `last_login` timestamps instead of saving the user on every login.
+# `'memory'` to buffer in each process, a cache alias to buffer in a shared
+# cache, or `None` to disable. See `polymorphic_auth.last_login`.
+LAST_LOGIN_BUFFER = POLYMORPHIC_AUTH.get('LAST_LOGIN_BUFFER')
+
+# Write buffered timestamps within this many seconds of being buffered (by a
+# timer thread in the process that buffered them), or when this many logins
+# are buffered.
+LAST_LOGIN_FLUSH_INTERVAL = POLYMORPHIC_AUTH.get(
+    'LAST_LOGIN_FLUSH_INTERVAL', 60)
+LAST_LOGIN_FLUSH_LIMIT = POLYMORPHIC_AUTH.get('LAST_LOGIN_FLUSH_LIMIT', 1000)
+
+# Upgrade password hashes created with an outdated hasher or iteration count
+# on login. `'save'` to rehash and save the user during the login request (as
+# Django does), or `'queue'` to rehash in a background thread and update only
+# the password column. `'queue'` requires `PolymorphicAuthenticationMiddleware`
+# instead of `AuthenticationMiddleware`, or every upgrade logs the user out.
+PASSWORD_UPGRADE = POLYMORPHIC_AUTH.get('PASSWORD_UPGRADE', 'save')
+
+# Alias of a cache in the `CACHES` setting, used to keep sessions
+# authenticated after a queued password upgrade.
+PASSWORD_UPGRADE_CACHE = POLYMORPHIC_AUTH.get(
+    'PASSWORD_UPGRADE_CACHE', 'default')
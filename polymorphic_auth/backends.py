@@ -0,0 +1,162 @@
+"""
+Authentication backends for polymorphic users.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.contrib.auth import HASH_SESSION_KEY
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.contenttypes.models import ContentType
+
+from polymorphic_auth import appsettings, caching
+from polymorphic_auth.models import User
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+
+# Session key for the content type ID of the logged in user.
+CONTENT_TYPE_SESSION_KEY = '_polymorphic_auth_content_type_id'
+
+# Hints from the current request's session, which are not otherwise available
+# to `get_user()`. See: `PolymorphicAuthenticationMiddleware`
+_hints = threading.local()
+
+
+@contextmanager
+def session_hints(request):
+    """
+    Make the content type ID and session auth hash stored in the session
+    available to backends while the user for ``request`` is loaded.
+    """
+    session = getattr(request, 'session', {})
+    _hints.content_type_id = session.get(CONTENT_TYPE_SESSION_KEY)
+    _hints.session_auth_hash = session.get(HASH_SESSION_KEY)
+    try:
+        yield
+    finally:
+        del _hints.content_type_id
+        del _hints.session_auth_hash
+
+
+def store_content_type_in_session(sender, request, user, **kwargs):
+    """
+    Store the content type ID of the user in the session on login.
+    """
+    content_type_id = getattr(user, 'polymorphic_ctype_id', None)
+    if content_type_id and hasattr(request, 'session'):
+        request.session[CONTENT_TYPE_SESSION_KEY] = content_type_id
+
+
+def get_child_model(content_type_id):
+    """
+    Return the polymorphic child model for a content type ID, or ``None``.
+    """
+    if not content_type_id:
+        return None
+    try:
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+    except ContentType.DoesNotExist:
+        return None
+    if model is not None and issubclass(model, User):
+        return model
+
+
+class PolymorphicModelBackend(ModelBackend):
+    """
+    Load the concrete child model instance for a user with a single query.
+
+    If the user's content type ID is stored in the session (see
+    ``PolymorphicAuthenticationMiddleware``), the child table is queried
+    directly. Otherwise the parent table is queried with a join to the table
+    for each registered child model.
+
+    If the ``USER_CACHE`` setting is enabled, users are cached and only
+    queried on a cache miss. Permissions are loaded with a single query, and
+    cached if the ``PERMISSION_CACHE`` setting is enabled.
+    """
+
+    def get_user(self, user_id):
+        """
+        Return the child model instance for an active user, from the user
+        cache if enabled.
+        """
+        user = None
+        if appsettings.USER_CACHE:
+            user = caching.get_cached_user(
+                user_id, getattr(_hints, 'session_auth_hash', None))
+        if user is None:
+            user = self.get_user_from_database(user_id)
+            if user is not None and appsettings.USER_CACHE:
+                caching.cache_user(user)
+        if user is not None and self.user_can_authenticate(user):
+            return user
+
+    def get_all_permissions(self, user_obj, obj=None):
+        """
+        Return user and group permissions with a single query, or from the
+        permission cache if enabled.
+        """
+        if not user_obj.is_active or user_obj.is_anonymous() or \
+                obj is not None:
+            return set()
+        return caching.get_all_permissions(user_obj)
+
+    def user_can_authenticate(self, user):
+        """
+        Reject users with ``is_active=False``.
+        """
+        is_active = getattr(user, 'is_active', None)
+        return is_active or is_active is None
+
+    def get_user_from_database(self, user_id):
+        model = get_child_model(getattr(_hints, 'content_type_id', None))
+        if model is not None:
+            try:
+                return model.objects.non_polymorphic().get(pk=user_id)
+            except User.DoesNotExist:
+                # The user may have been deleted, or its type changed.
+                pass
+        try:
+            return self.get_user_from_parent(user_id)
+        except User.DoesNotExist:
+            return None
+
+    def get_user_from_parent(self, user_id):
+        """
+        Return the child model instance for a user from the parent table,
+        joined with each registered child model table.
+        """
+        links = self.get_child_links()
+        user = User.objects.non_polymorphic() \
+            .select_related(*[query_name for query_name, _, _ in links]) \
+            .get(pk=user_id)
+        model = get_child_model(user.polymorphic_ctype_id)
+        if model is None or model is User:
+            return user
+        for query_name, accessor, child_model in links:
+            if child_model is model:
+                return getattr(user, accessor)
+        # Not a registered child model. Upcast with another query.
+        return user.get_real_instance()
+
+    def get_child_links(self):
+        """
+        Return a list of 3-tuples containing the query name, accessor name and
+        model for each registered child model of the parent model.
+        """
+        models = set(
+            plugin.model
+            for plugin in PolymorphicAuthChildModelPlugin.get_plugins())
+        links = []
+        # The reverse relations on the parent model have the query name used
+        # by `select_related()`. Parent links inherited from an abstract model
+        # report the abstract model's name on Django 1.8.
+        for related in User._meta.related_objects:
+            if not related.one_to_one or related.related_model not in models:
+                continue
+            rel = getattr(related.field, 'remote_field', None) or \
+                related.field.rel
+            if rel.parent_link:
+                links.append(
+                    (related.field.related_query_name(),
+                     related.get_accessor_name(), related.related_model))
+        return links
@@ -0,0 +1,222 @@
+"""
+Cache users and their permissions in Django's cache framework, and invalidate
+them when they change.
+"""
+
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.db import router
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils.crypto import constant_time_compare
+
+from polymorphic_auth import appsettings
+from polymorphic_auth.models import User
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+
+USER_KEY = 'polymorphic_auth:user:%s'
+PERMISSIONS_KEY = 'polymorphic_auth:permissions:%s'
+
+
+def get_cache():
+    return caches[appsettings.USER_CACHE]
+
+
+def get_permission_cache():
+    return caches[appsettings.PERMISSION_CACHE]
+
+
+def cache_user(user):
+    """
+    Cache the content type ID, session auth hash (a fingerprint of the
+    password hash) and concrete field values of a user.
+    """
+    values = tuple(getattr(user, f.attname) for f in user._meta.concrete_fields)
+    get_cache().set(
+        USER_KEY % user.pk,
+        (user.polymorphic_ctype_id, user.get_session_auth_hash(), values),
+        appsettings.USER_CACHE_TIMEOUT)
+
+
+def get_cached_user(user_id, session_auth_hash=None):
+    """
+    Return a cached user, or ``None``. If ``session_auth_hash`` is given, the
+    cached user is only returned if its password hash matches.
+    """
+    data = get_cache().get(USER_KEY % user_id)
+    if data is None:
+        return None
+    content_type_id, auth_hash, values = data
+    if session_auth_hash is not None and \
+            not constant_time_compare(session_auth_hash, auth_hash):
+        return None
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model is None:
+        return None
+    field_names = [f.attname for f in model._meta.concrete_fields]
+    if len(field_names) != len(values):
+        # Cached before a schema change.
+        return None
+    return model.from_db(router.db_for_read(model), field_names, values)
+
+
+def get_all_permissions(user):
+    """
+    Return a frozenset of ``app_label.codename`` strings for the user and
+    group permissions of a user. Permissions are cached on the instance and
+    in the permission cache, if enabled, and otherwise queried with a single
+    query.
+    """
+    if not hasattr(user, '_perm_cache'):
+        perms = None
+        if appsettings.PERMISSION_CACHE:
+            perms = get_permission_cache().get(PERMISSIONS_KEY % user.pk)
+        if perms is None:
+            if user.is_superuser:
+                perms = Permission.objects.all()
+            else:
+                perms = Permission.objects \
+                    .filter(Q(user=user) | Q(group__user=user)).distinct()
+            perms = frozenset(
+                '%s.%s' % (app_label, codename)
+                for app_label, codename in perms.values_list(
+                    'content_type__app_label', 'codename'))
+            if appsettings.PERMISSION_CACHE:
+                get_permission_cache().set(
+                    PERMISSIONS_KEY % user.pk, perms,
+                    appsettings.PERMISSION_CACHE_TIMEOUT)
+        user._perm_cache = perms
+    return user._perm_cache
+
+
+def warm_permissions(users):
+    """
+    Load permissions for many users at once, e.g. for a list view, from the
+    permission cache and then with at most three queries for the rest.
+    """
+    users = [user for user in users if not hasattr(user, '_perm_cache')]
+    if appsettings.PERMISSION_CACHE and users:
+        cached = get_permission_cache().get_many(
+            [PERMISSIONS_KEY % user.pk for user in users])
+        for user in users:
+            perms = cached.get(PERMISSIONS_KEY % user.pk)
+            if perms is not None:
+                user._perm_cache = perms
+        users = [user for user in users if not hasattr(user, '_perm_cache')]
+    if not users:
+        return
+    perms = dict((user.pk, set()) for user in users)
+    if any(user.is_superuser for user in users):
+        all_perms = set(
+            '%s.%s' % p for p in Permission.objects.values_list(
+                'content_type__app_label', 'codename'))
+        for user in users:
+            if user.is_superuser:
+                perms[user.pk] = all_perms
+    pks = [user.pk for user in users if not user.is_superuser]
+    if pks:
+        for query in (
+                User.user_permissions.through._default_manager.filter(
+                    user__in=pks).values_list(
+                        'user', 'permission__content_type__app_label',
+                        'permission__codename'),
+                Permission.objects.filter(group__user__in=pks).values_list(
+                    'group__user', 'content_type__app_label', 'codename')):
+            for pk, app_label, codename in query:
+                perms[pk].add('%s.%s' % (app_label, codename))
+    for user in users:
+        user._perm_cache = frozenset(perms[user.pk])
+    if appsettings.PERMISSION_CACHE:
+        get_permission_cache().set_many(
+            dict((PERMISSIONS_KEY % user.pk, user._perm_cache)
+                 for user in users),
+            appsettings.PERMISSION_CACHE_TIMEOUT)
+
+
+def invalidate_users(user_ids):
+    """
+    Remove users and their permissions from the cache.
+    """
+    if not appsettings.USER_CACHE and not appsettings.PERMISSION_CACHE:
+        return
+    user_ids = list(user_ids)
+    if appsettings.USER_CACHE:
+        get_cache().delete_many([USER_KEY % pk for pk in user_ids])
+    if appsettings.PERMISSION_CACHE:
+        get_permission_cache().delete_many(
+            [PERMISSIONS_KEY % pk for pk in user_ids])
+
+
+# SIGNAL HANDLERS #############################################################
+
+
+def invalidate_user(sender, instance, **kwargs):
+    invalidate_users([instance.pk])
+
+
+# Names of the many-to-many fields on `User` for each through model.
+M2M_FIELDS = {
+    User.groups.through: 'groups',
+    User.user_permissions.through: 'user_permissions',
+}
+
+
+def invalidate_m2m_users(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate users when their groups or permissions change, from either
+    side of the relationship.
+    """
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_users([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_users(pk_set)
+    elif action == 'pre_clear':
+        invalidate_users(
+            User._base_manager.filter(**{M2M_FIELDS[sender]: instance})
+            .values_list('pk', flat=True))
+
+
+def invalidate_group_users(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    """
+    Invalidate users in groups when the permissions of the groups change.
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        groups = [instance.pk]
+    elif action == 'pre_clear':
+        groups = instance.group_set.values_list('pk', flat=True)
+    else:
+        groups = pk_set
+    invalidate_users(
+        User._base_manager.filter(groups__in=list(groups)).distinct()
+        .values_list('pk', flat=True))
+
+
+def connect_signals():
+    """
+    Invalidate cached users and permissions on save and delete of the parent
+    model and every registered child model, and when their groups or
+    permissions change.
+    """
+    models = [User] + [
+        plugin.model
+        for plugin in PolymorphicAuthChildModelPlugin.get_plugins()
+    ]
+    for model in models:
+        post_save.connect(
+            invalidate_user, sender=model,
+            dispatch_uid='polymorphic_auth.caching.post_save.%s' % model)
+        post_delete.connect(
+            invalidate_user, sender=model,
+            dispatch_uid='polymorphic_auth.caching.post_delete.%s' % model)
+    for through in M2M_FIELDS:
+        m2m_changed.connect(
+            invalidate_m2m_users, sender=through,
+            dispatch_uid='polymorphic_auth.caching.m2m_changed.%s' % through)
+    m2m_changed.connect(
+        invalidate_group_users, sender=Group.permissions.through,
+        dispatch_uid='polymorphic_auth.caching.invalidate_group_users')
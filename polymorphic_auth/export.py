@@ -0,0 +1,103 @@
+"""
+Stream field values for users of every type, without loading all users or
+model instances into memory.
+"""
+
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+
+from polymorphic_auth.models import User
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+
+# Fields that are not exported unless explicitly requested.
+EXCLUDED_FIELDS = ('password', 'polymorphic_ctype')
+
+
+def get_model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def get_export_columns(models=None, exclude=EXCLUDED_FIELDS):
+    """
+    Return a list of column names for the parent model and each of ``models``
+    (default: registered plugin models), starting with ``type``.
+    """
+    if models is None:
+        models = [
+            plugin.model
+            for plugin in PolymorphicAuthChildModelPlugin.get_plugins()
+        ]
+    columns = ['type']
+    for model in [User] + list(models):
+        for field in model._meta.concrete_fields:
+            # Skip excluded fields and links from child to parent models.
+            if field.name in exclude or \
+                    field.primary_key and model is not User:
+                continue
+            if field.name not in columns:
+                columns.append(field.name)
+    return columns
+
+
+def iter_user_rows(queryset=None, columns=None, chunk_size=1000):
+    """
+    Yield a dict of ``columns`` (default: ``get_export_columns()``) for each
+    user in ``queryset`` (default: all users), in primary key order. Columns
+    that do not apply to a user's type are ``None``.
+
+    Users are read in chunks of ``chunk_size`` with keyset pagination on the
+    primary key. Values for each chunk are fetched with one query per user
+    type, instead of one query per user type per polymorphic queryset.
+    """
+    if queryset is None:
+        queryset = User.objects.all()
+    if columns is None:
+        columns = get_export_columns()
+    queryset = queryset.non_polymorphic().order_by('pk')
+    models = {}
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(
+            chunk.values_list('pk', 'polymorphic_ctype')[:chunk_size])
+        if not chunk:
+            return
+        last_pk = chunk[-1][0]
+        pks_by_ctype = defaultdict(list)
+        for pk, ctype_id in chunk:
+            pks_by_ctype[ctype_id].append(pk)
+        rows = {}
+        for ctype_id, pks in pks_by_ctype.items():
+            if ctype_id not in models:
+                models[ctype_id] = _get_model(ctype_id)
+            model = models[ctype_id]
+            field_names = set(f.name for f in model._meta.concrete_fields)
+            names = [c for c in columns if c in field_names]
+            values = model._base_manager.using(queryset.db) \
+                .filter(pk__in=pks).values('pk', *names)
+            for value in values:
+                row = dict.fromkeys(columns)
+                row.update((name, value[name]) for name in names)
+                if 'type' in row:
+                    row['type'] = get_model_label(model)
+                rows[value['pk']] = row
+        for pk, ctype_id in chunk:
+            # Skip users that were deleted since the chunk was read.
+            if pk in rows:
+                yield rows[pk]
+
+
+def _get_model(ctype_id):
+    """
+    Return the model for a content type ID, or the parent model if the content
+    type is unknown or its model is not installed.
+    """
+    if ctype_id is None:
+        return User
+    model = ContentType.objects.get_for_id(ctype_id).model_class()
+    if model is None or not issubclass(model, User):
+        return User
+    return model
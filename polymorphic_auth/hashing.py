@@ -0,0 +1,162 @@
+"""
+Password hashing helpers for operations on many users at once, and for
+hashing passwords outside the current thread.
+"""
+
+import logging
+import threading
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connections, router, transaction
+
+from polymorphic_auth import appsettings
+
+logger = logging.getLogger(__name__)
+
+UPGRADED_SESSION_HASH_KEY = 'polymorphic_auth:upgraded_session_hash:%s'
+
+# Thread pool for deferred password hashing and upgrades, created on first
+# use, and the number of submitted jobs that have not finished. Results are
+# not kept, so they don't pile up in a long-running process.
+_deferred = {'pool': None, 'pending': 0}
+_deferred_done = threading.Condition()
+
+
+def get_hasher_pool(workers):
+    """
+    Return a process pool with ``workers`` processes, or ``None`` if fewer
+    than two workers are requested.
+    """
+    if workers and workers > 1:
+        return Pool(workers)
+    return None
+
+
+def hash_passwords(passwords, pool=None):
+    """
+    Return a list of encoded passwords for a list of raw passwords, hashed in
+    ``pool`` if given. A ``None`` password is encoded as an unusable password.
+    """
+    passwords = list(passwords)
+    if pool is None or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    return pool.map(make_password, passwords)
+
+
+def defer_set_password(user, raw_password):
+    """
+    Hash ``raw_password`` in a background thread and update the password
+    column for a saved ``user``, after the current transaction is committed.
+
+    Django < 1.9 has no ``on_commit()``, so the password is hashed and saved
+    in the current thread when called inside a transaction.
+    """
+    model = user._meta.get_field('password').model
+    using = user._state.db or router.db_for_write(model)
+    _submit(_set_password, (model, user.pk, raw_password, using), using)
+
+
+def queue_password_upgrade(user, raw_password):
+    """
+    Rehash ``raw_password`` with the preferred hasher in a background thread,
+    and update the password column for ``user`` if it still has the same
+    password hash. This skips ``save()`` and its signals.
+    """
+    model = user._meta.get_field('password').model
+    using = user._state.db or router.db_for_write(model)
+    _submit(_upgrade_password, (
+        model, user.pk, user.password, raw_password, using), using)
+
+
+def _submit(func, args, using):
+    def submit():
+        with _deferred_done:
+            if _deferred['pool'] is None:
+                _deferred['pool'] = ThreadPool(
+                    appsettings.DEFERRED_HASHING_THREADS)
+            _deferred['pending'] += 1
+            _deferred['pool'].apply_async(_run, (func, args, using))
+
+    # Django < 1.9 has no `on_commit()`.
+    on_commit = getattr(transaction, 'on_commit', None)
+    if on_commit is not None:
+        on_commit(submit, using=using)
+    elif connections[using].in_atomic_block:
+        # A worker could update the row before it is committed, or before the
+        # transaction is rolled back, so do it in this thread instead.
+        func(*args)
+    else:
+        submit()
+
+
+def _run(func, args, using):
+    # Log errors here, because nothing waits for the result. (Python 2's
+    # `apply_async()` has no `error_callback`.)
+    try:
+        func(*args)
+    except Exception:
+        logger.exception(
+            'Error in deferred password job %s%r.', func.__name__, args[:2])
+    finally:
+        # Don't leave a connection open in the worker thread.
+        connections[using].close()
+        with _deferred_done:
+            _deferred['pending'] -= 1
+            _deferred_done.notify_all()
+
+
+def _set_password(model, pk, raw_password, using):
+    updated = model._base_manager.using(using).filter(pk=pk).update(
+        password=make_password(raw_password))
+    if not updated:
+        raise model.DoesNotExist(
+            'Could not set the password for %s with pk %r, which does not '
+            'exist.' % (model._meta.object_name, pk))
+
+
+def _upgrade_password(model, pk, old_password, raw_password, using):
+    from polymorphic_auth import caching
+    new_password = make_password(raw_password)
+    updated = model._base_manager.using(using) \
+        .filter(pk=pk, password=old_password) \
+        .update(password=new_password)
+    if updated:
+        # Let sessions authenticated with the old hash switch to the new one.
+        # See `update_session_auth_hash()`.
+        caches[appsettings.PASSWORD_UPGRADE_CACHE].set(
+            UPGRADED_SESSION_HASH_KEY
+            % model(password=old_password).get_session_auth_hash(),
+            model(password=new_password).get_session_auth_hash(),
+            settings.SESSION_COOKIE_AGE)
+        caching.invalidate_users([pk])
+
+
+def update_session_auth_hash(session):
+    """
+    Replace the session auth hash stored in ``session`` if the password hash
+    it was derived from was upgraded by ``queue_password_upgrade()``, so the
+    session stays authenticated. Must be called before the user is loaded from
+    the session, as ``PolymorphicAuthenticationMiddleware`` does.
+    """
+    session_hash = session.get(HASH_SESSION_KEY)
+    if session_hash:
+        upgraded = caches[appsettings.PASSWORD_UPGRADE_CACHE].get(
+            UPGRADED_SESSION_HASH_KEY % session_hash)
+        if upgraded:
+            session[HASH_SESSION_KEY] = upgraded
+
+
+def wait_for_deferred_passwords():
+    """
+    Wait until passwords submitted with ``defer_set_password()`` or
+    ``queue_password_upgrade()`` have been hashed and saved, e.g. in tests or
+    before a management command exits. Errors are logged by the workers.
+    """
+    with _deferred_done:
+        while _deferred['pending']:
+            _deferred_done.wait()
@@ -0,0 +1,153 @@
+"""
+Measure the number of queries and the time spent in ``polymorphic_auth``
+operations, and report them to receivers of the ``operation_completed`` signal
+and to the callable named by the ``METRICS_CALLBACK`` setting.
+
+Nothing is measured when there are no receivers and no callback.
+"""
+
+import functools
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.db import connections
+from django.dispatch import Signal
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from polymorphic_auth import appsettings
+
+# Sent with the operation name, its duration in seconds and the number of
+# queries it executed.
+operation_completed = Signal(
+    providing_args=['operation', 'duration', 'queries'])
+
+# Imported metrics callbacks, keyed by dotted path.
+_callbacks = {}
+
+
+def get_metrics_callback():
+    """
+    Return the ``METRICS_CALLBACK`` callable, or ``None``.
+    """
+    callback = appsettings.METRICS_CALLBACK
+    if isinstance(callback, six.string_types):
+        if callback not in _callbacks:
+            _callbacks[callback] = import_string(callback)
+        callback = _callbacks[callback]
+    return callback
+
+
+class _CountingCursorWrapper(object):
+    """
+    Count the queries executed by a cursor, for Django < 2.0, which has no
+    ``execute_wrapper()``.
+    """
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cursor.__exit__(exc_type, exc_value, traceback)
+
+    def callproc(self, *args, **kwargs):
+        self.connection._instrumented_queries += 1
+        return self.cursor.callproc(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        self.connection._instrumented_queries += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.connection._instrumented_queries += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+
+def _count_query(execute, sql, params, many, context):
+    context['connection']._instrumented_queries += 1
+    return execute(sql, params, many, context)
+
+
+def _start_counting(connection):
+    """
+    Count queries executed by ``connection``, unless an enclosing block is
+    already counting them.
+    """
+    depth = getattr(connection, '_instrumented_depth', 0)
+    if not depth:
+        connection._instrumented_queries = 0
+        if hasattr(connection, 'execute_wrappers'):
+            connection.execute_wrappers.append(_count_query)
+        else:
+            make_cursor = connection.make_cursor
+            make_debug_cursor = connection.make_debug_cursor
+            connection.make_cursor = lambda cursor: _CountingCursorWrapper(
+                make_cursor(cursor), connection)
+            connection.make_debug_cursor = \
+                lambda cursor: _CountingCursorWrapper(
+                    make_debug_cursor(cursor), connection)
+    connection._instrumented_depth = depth + 1
+
+
+def _stop_counting(connection):
+    connection._instrumented_depth -= 1
+    if not connection._instrumented_depth:
+        if hasattr(connection, 'execute_wrappers'):
+            connection.execute_wrappers.remove(_count_query)
+        else:
+            del connection.make_cursor
+            del connection.make_debug_cursor
+
+
+@contextmanager
+def instrument(operation):
+    """
+    Report the duration and number of queries of the enclosed block as
+    ``operation``.
+    """
+    callback = get_metrics_callback()
+    if callback is None and not operation_completed.has_listeners():
+        yield
+        return
+    counted = list(connections.all())
+    for connection in counted:
+        _start_counting(connection)
+    counts = [connection._instrumented_queries for connection in counted]
+    start = default_timer()
+    try:
+        yield
+    finally:
+        duration = default_timer() - start
+        queries = sum(
+            connection._instrumented_queries - count
+            for connection, count in zip(counted, counts))
+        for connection in counted:
+            _stop_counting(connection)
+        operation_completed.send(
+            sender=None, operation=operation, duration=duration,
+            queries=queries)
+        if callback is not None:
+            callback(operation, duration, queries)
+
+
+def instrumented(operation):
+    """
+    Decorate a function to report each call as ``operation``.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with instrument(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,248 @@
+"""
+Buffer ``last_login`` timestamps and write them in batches, instead of with an
+``UPDATE`` on the parent user table for every login.
+
+Enable with the ``LAST_LOGIN_BUFFER`` setting: ``'memory'`` to buffer in each
+process, or a cache alias to buffer in a cache shared by all processes.
+Buffered timestamps are written with a single ``UPDATE ... CASE`` statement
+per batch: in a background thread within ``LAST_LOGIN_FLUSH_INTERVAL`` seconds
+of being buffered (by a timer, even if no other login happens) or when
+``LAST_LOGIN_FLUSH_LIMIT`` logins are pending, at process exit (for the memory
+buffer), or by the ``flush_last_login`` management command (for a cache
+buffer).
+
+Buffering is best-effort: timestamps that are still buffered when a process
+is killed, or that are evicted from the cache, are lost.
+"""
+
+import atexit
+import threading
+from timeit import default_timer
+
+from django.contrib.auth.models import update_last_login
+from django.contrib.auth.signals import user_logged_in
+from django.core.cache import caches
+from django.db import connections, models, router
+from django.db.models import Case, Value, When
+from django.utils import timezone
+
+from polymorphic_auth import appsettings, caching
+from polymorphic_auth.models import User, _chunked
+
+COUNTER_KEY = 'polymorphic_auth:last_login:counter'
+FLUSHED_KEY = 'polymorphic_auth:last_login:flushed'
+FLUSH_TIMER_KEY = 'polymorphic_auth:last_login:timer'
+GAP_KEY = 'polymorphic_auth:last_login:gap'
+LOCK_KEY = 'polymorphic_auth:last_login:lock'
+SLOT_KEY = 'polymorphic_auth:last_login:%s'
+
+# The background flush thread and the flush timer, if they are running.
+_flush_thread = {'thread': None, 'timer': None}
+_flush_thread_lock = threading.Lock()
+
+
+class MemoryBuffer(object):
+    """
+    Buffer timestamps in a dict for the current process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.last_flush = default_timer()
+
+    def add(self, user_id, timestamp):
+        """
+        Buffer a timestamp. Returns ``True`` if the buffer should be flushed.
+        """
+        with self.lock:
+            self.pending[user_id] = timestamp
+            return len(self.pending) >= appsettings.LAST_LOGIN_FLUSH_LIMIT \
+                or default_timer() - self.last_flush \
+                >= appsettings.LAST_LOGIN_FLUSH_INTERVAL
+
+    def pop(self):
+        """
+        Return and clear buffered timestamps, keyed by user ID.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = default_timer()
+        return pending
+
+
+class CacheBuffer(object):
+    """
+    Buffer timestamps in numbered cache keys, shared by all processes.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def add(self, user_id, timestamp):
+        """
+        Buffer a timestamp. Returns ``True`` if the buffer should be flushed.
+        """
+        self.cache.add(COUNTER_KEY, 0, None)
+        slot = self.cache.incr(COUNTER_KEY)
+        self.cache.set(SLOT_KEY % slot, (user_id, timestamp), None)
+        flushed = self.cache.get(FLUSHED_KEY, 0)
+        return slot - flushed >= appsettings.LAST_LOGIN_FLUSH_LIMIT or \
+            self.cache.add(
+                FLUSH_TIMER_KEY, 1, appsettings.LAST_LOGIN_FLUSH_INTERVAL)
+
+    def pop(self):
+        """
+        Return and clear buffered timestamps, keyed by user ID. Only one
+        process can pop at a time. Others get an empty dict.
+
+        Slots are read in order up to the first one that has been numbered
+        but not yet written by ``add()``, which is left for the next pop. If
+        it is still missing then, it is skipped as lost (e.g. the process was
+        killed between numbering and writing it).
+        """
+        if not self.cache.add(LOCK_KEY, 1, 60):
+            return {}
+        try:
+            flushed = self.cache.get(FLUSHED_KEY, 0)
+            counter = self.cache.get(COUNTER_KEY, 0)
+            lost = self.cache.get(GAP_KEY)
+            pending = {}
+            gap = None
+            for chunk in _chunked(range(flushed + 1, counter + 1), 1000):
+                keys = [SLOT_KEY % slot for slot in chunk]
+                values = self.cache.get_many(keys)
+                read = []
+                for slot, key in zip(chunk, keys):
+                    if key in values:
+                        user_id, timestamp = values[key]
+                        pending[user_id] = max(
+                            timestamp, pending.get(user_id, timestamp))
+                        read.append(key)
+                    elif slot != lost:
+                        gap = slot
+                        break
+                    flushed = slot
+                self.cache.delete_many(read)
+                if gap is not None:
+                    break
+            self.cache.set(FLUSHED_KEY, flushed, None)
+            self.cache.set(GAP_KEY, gap, None)
+            return pending
+        finally:
+            self.cache.delete(LOCK_KEY)
+
+
+_memory_buffer = MemoryBuffer()
+
+
+def get_buffer():
+    """
+    Return the buffer for the ``LAST_LOGIN_BUFFER`` setting, or ``None``.
+    """
+    if appsettings.LAST_LOGIN_BUFFER == 'memory':
+        return _memory_buffer
+    if appsettings.LAST_LOGIN_BUFFER:
+        return CacheBuffer(appsettings.LAST_LOGIN_BUFFER)
+
+
+def buffer_last_login(sender, user, **kwargs):
+    """
+    Replacement for Django's ``update_last_login`` receiver, which buffers the
+    timestamp instead of saving the user.
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        update_last_login(sender, user, **kwargs)
+        return
+    user.last_login = timezone.now()
+    if buffer.add(user.pk, user.last_login):
+        flush_in_background()
+    else:
+        schedule_flush()
+
+
+def schedule_flush():
+    """
+    Call ``flush_in_background()`` in ``LAST_LOGIN_FLUSH_INTERVAL`` seconds,
+    unless a timer is already running, so buffered timestamps are written
+    even if no other login happens.
+    """
+    with _flush_thread_lock:
+        timer = _flush_thread['timer']
+        if timer is not None and timer.is_alive():
+            return
+        timer = threading.Timer(
+            appsettings.LAST_LOGIN_FLUSH_INTERVAL, flush_in_background)
+        timer.daemon = True
+        timer.start()
+        _flush_thread['timer'] = timer
+
+
+def flush_in_background():
+    """
+    Call ``flush()`` in a background thread, unless one is already running.
+    """
+    with _flush_thread_lock:
+        thread = _flush_thread['thread']
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_flush_and_close)
+        thread.daemon = True
+        thread.start()
+        _flush_thread['thread'] = thread
+
+
+def _flush_and_close():
+    try:
+        flush()
+    finally:
+        # Don't leave connections open in the background thread.
+        for connection in connections.all():
+            connection.close()
+
+
+def wait_for_flush():
+    """
+    Wait until the background flush thread, if any, has finished.
+    """
+    thread = _flush_thread['thread']
+    if thread is not None:
+        thread.join()
+
+
+def flush():
+    """
+    Write buffered timestamps, with one ``UPDATE`` per batch of users, and
+    remove the users from the user cache. Returns the number of users updated.
+    """
+    buffer = get_buffer()
+    pending = buffer.pop() if buffer is not None else None
+    if not pending:
+        return 0
+    using = router.db_for_write(User)
+    # Two parameters per user in the `CASE` plus one in the `IN` clause.
+    batch_size = connections[using].ops.bulk_batch_size(
+        ['pk', 'last_login', 'pk'], list(pending)) or len(pending)
+    for user_ids in _chunked(sorted(pending), batch_size):
+        User._base_manager.using(using).filter(pk__in=user_ids).update(
+            last_login=Case(
+                *[When(pk=user_id, then=Value(
+                    pending[user_id], output_field=models.DateTimeField()))
+                  for user_id in user_ids],
+                output_field=models.DateTimeField()))
+        caching.invalidate_users(user_ids)
+    return len(pending)
+
+
+def connect_signals():
+    """
+    Replace Django's ``update_last_login`` receiver.
+    """
+    user_logged_in.disconnect(update_last_login)
+    user_logged_in.disconnect(dispatch_uid='update_last_login')
+    user_logged_in.connect(
+        buffer_last_login,
+        dispatch_uid='polymorphic_auth.last_login.buffer_last_login')
+    if appsettings.LAST_LOGIN_BUFFER == 'memory':
+        atexit.register(flush)
@@ -0,0 +1,36 @@
+"""
+Archive users in batches, or restore archived users.
+"""
+
+from polymorphic_auth.management.commands import purge_users
+from polymorphic_auth.models import ArchivedUser, User
+
+
+class Command(purge_users.Command):
+    help = 'Copy inactive users to the archive table and delete them, or ' \
+           'restore archived users.'
+    verb = 'Archived and deleted'
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            '--restore', action='store_true', default=False,
+            help='Restore archived users, or only those with --ids.')
+
+    def handle(self, *args, **options):
+        if not options['restore']:
+            return super(Command, self).handle(*args, **options)
+        queryset = ArchivedUser.objects.all()
+        if options['ids']:
+            queryset = queryset.filter(user_id__in=[
+                int(pk) for pk in options['ids'].split(',')])
+        if options['dry_run']:
+            self.stdout.write('Would restore %d users.' % queryset.count())
+            return
+        count = User.objects.restore(
+            queryset, batch_size=options['batch_size'])
+        self.stdout.write('Restored %d users.' % count)
+
+    def run(self, queryset, batch_size, dry_run):
+        return User.objects.archive(
+            queryset, batch_size=batch_size, dry_run=dry_run)
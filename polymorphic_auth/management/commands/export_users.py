@@ -0,0 +1,59 @@
+"""
+Export users of every type to a CSV or JSON lines file.
+"""
+
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from polymorphic_auth import export
+
+
+class Command(BaseCommand):
+    help = 'Export users of every type to a CSV or JSON lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=('csv', 'jsonl'), default='csv',
+            help='Output format. Default: csv')
+        parser.add_argument(
+            '--output', help='File to write to. Default: stdout')
+        parser.add_argument(
+            '--columns',
+            help='Comma separated list of columns to export. Default: all '
+                 'fields of the parent model and each plugin model, except '
+                 'password.')
+        parser.add_argument(
+            '--chunk-size', default=1000, type=int,
+            help='Number of users to read in each chunk. Default: 1000')
+
+    def handle(self, *args, **options):
+        available = export.get_export_columns(exclude=())
+        if options['columns']:
+            columns = [c.strip() for c in options['columns'].split(',')]
+            unknown = [c for c in columns if c not in available]
+            if unknown:
+                raise CommandError(
+                    'Unknown columns: %s. Available columns: %s' % (
+                        ', '.join(unknown), ', '.join(available)))
+        else:
+            columns = export.get_export_columns()
+        rows = export.iter_user_rows(
+            columns=columns, chunk_size=options['chunk_size'])
+
+        f = open(options['output'], 'w') if options['output'] \
+            else self.stdout
+        try:
+            if options['format'] == 'csv':
+                writer = csv.DictWriter(f, columns)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+            else:
+                for row in rows:
+                    f.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+        finally:
+            if f is not self.stdout:
+                f.close()
@@ -0,0 +1,24 @@
+"""
+Write buffered ``last_login`` timestamps to the database.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polymorphic_auth import appsettings, last_login
+
+
+class Command(BaseCommand):
+    help = (
+        'Write last_login timestamps buffered in a cache to the database. '
+        'Timestamps buffered in memory can only be written by the process '
+        'that buffered them.'
+    )
+
+    def handle(self, *args, **options):
+        if appsettings.LAST_LOGIN_BUFFER == 'memory':
+            raise CommandError(
+                'LAST_LOGIN_BUFFER is "memory", so timestamps are buffered in '
+                'the memory of each process and this command has none to '
+                'write. They are written by the process that buffered them.')
+        count = last_login.flush()
+        self.stdout.write('Updated last_login for %d users.' % count)
@@ -0,0 +1,172 @@
+"""
+Import users from a CSV or JSON lines file.
+"""
+
+import csv
+import io
+import itertools
+import json
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import six
+
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+
+
+def iter_csv_rows(f):
+    """
+    Yield a dict for each row in a CSV file with a header row.
+    """
+    for row in csv.DictReader(f):
+        yield row
+
+
+def iter_jsonl_rows(f):
+    """
+    Yield a dict for each non-blank line in a JSON lines file.
+    """
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+READERS = {
+    'csv': iter_csv_rows,
+    'jsonl': iter_jsonl_rows,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users from a CSV or JSON lines file with `try_create()`, '
+        'skipping users that already exist.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the file to import.')
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='File format. Default: inferred from the file extension.')
+        parser.add_argument(
+            '--type-column', default='type',
+            help='Column with the `app_label.model_name` of the user type for '
+                 'each row. Rows without it use the default child model. '
+                 'Default: type')
+        parser.add_argument(
+            '--chunk-size', default=1000, type=int,
+            help='Number of rows to import in each transaction. Default: 1000')
+        parser.add_argument(
+            '--offset', default=0, type=int,
+            help='Number of rows to skip, to resume an import. Default: 0')
+        parser.add_argument(
+            '--checkpoint',
+            help='File to record the number of rows imported after each '
+                 'transaction. If the file exists, the import resumes from '
+                 'the offset it contains.')
+        parser.add_argument(
+            '--credentials', default=os.devnull,
+            help='File to append generated credentials to. Default: discard')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or \
+            ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        offset = max(options['offset'], self.read_checkpoint(options))
+        default_model = get_user_model()
+
+        if six.PY2 and fmt == 'csv':
+            f = open(path, 'rb')
+        else:
+            f = io.open(path, encoding='utf-8', newline='')
+        with f, open(options['credentials'], 'a') as credentials:
+            rows = itertools.islice(READERS[fmt](f), offset, None)
+            count = created = 0
+            start = time.time()
+            while True:
+                chunk = list(itertools.islice(rows, chunk_size))
+                if not chunk:
+                    break
+                with transaction.atomic():
+                    for i, row in enumerate(chunk, offset + count + 1):
+                        created += self.import_row(
+                            i, row, options['type_column'], default_model,
+                            credentials)
+                count += len(chunk)
+                self.write_checkpoint(options, offset + count)
+                elapsed = time.time() - start
+                self.stdout.write(
+                    'Imported %d rows (%d created, %d existing) in %.1fs, '
+                    '%.1f rows/s. Offset: %d' % (
+                        count, created, count - created, elapsed,
+                        count / elapsed if elapsed else 0, offset + count))
+
+    def import_row(self, i, row, type_column, default_model, credentials):
+        """
+        Create a user for a row. Returns ``True`` if the user was created.
+        """
+        row = dict(row)
+        label = row.pop(type_column, None)
+        if label:
+            plugin = PolymorphicAuthChildModelPlugin.get_plugin_for_label(label)
+            if plugin is None:
+                raise CommandError(
+                    'Row %d: Unknown user type %r.' % (i, label))
+            model = plugin.model
+        else:
+            model = default_model
+        try:
+            # Roll back a failed row in a savepoint, so the error can be
+            # reported with its row number.
+            with transaction.atomic():
+                kwargs = self.to_python(model, row)
+                user, created = model.try_create(
+                    _stdout=credentials, **kwargs)
+        except Exception as e:
+            # Includes `IntegrityError` and the error raised by `save()` for a
+            # username that clashes with an existing user.
+            raise CommandError('Row %d: %r' % (i, e))
+        return created
+
+    def to_python(self, model, row):
+        """
+        Convert string values from the file for model fields, and drop empty
+        values so field defaults are used.
+        """
+        kwargs = {}
+        for key, value in row.items():
+            if value is None or value == '':
+                continue
+            try:
+                field = model._meta.get_field(key)
+            except FieldDoesNotExist:
+                # Not a field. May be used to derive field values.
+                pass
+            else:
+                value = field.to_python(value)
+            kwargs[key] = value
+        return kwargs
+
+    def read_checkpoint(self, options):
+        """
+        Return the offset recorded in the checkpoint file, or 0.
+        """
+        path = options['checkpoint']
+        if not path or not os.path.exists(path):
+            return 0
+        with io.open(path) as f:
+            return int(f.read().strip() or 0)
+
+    def write_checkpoint(self, options, offset):
+        path = options['checkpoint']
+        if path:
+            with io.open(path, 'w') as f:
+                f.write(six.text_type(offset))
@@ -0,0 +1,54 @@
+"""
+Report how many users have password hashes from each hasher, and how many
+need to be upgraded to the preferred hasher.
+"""
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, \
+    get_hasher, get_hashers
+from django.core.management.base import BaseCommand
+from django.db.models import Case, Count, IntegerField, When
+
+from polymorphic_auth.models import User
+
+
+class Command(BaseCommand):
+    help = 'Report how many users have password hashes from each hasher.'
+
+    def handle(self, *args, **options):
+        preferred = get_hasher()
+        # Labels and `password__startswith` prefixes to count, most specific
+        # first. Each user is counted once, for the first matching prefix.
+        prefixes = [('unusable', UNUSABLE_PASSWORD_PREFIX)]
+        iterations = getattr(preferred, 'iterations', None)
+        if iterations:
+            prefixes.append((
+                '%s (%s iterations)' % (preferred.algorithm, iterations),
+                '%s$%s$' % (preferred.algorithm, iterations)))
+            prefixes.append((
+                '%s (other iterations)' % preferred.algorithm,
+                '%s$' % preferred.algorithm))
+        else:
+            prefixes.append((preferred.algorithm, '%s$' % preferred.algorithm))
+        for hasher in get_hashers():
+            if hasher.algorithm != preferred.algorithm:
+                prefixes.append((hasher.algorithm, '%s$' % hasher.algorithm))
+
+        # Count every prefix with a single query.
+        when = [
+            When(password__startswith=prefix, then=i)
+            for i, (label, prefix) in enumerate(prefixes)
+        ]
+        counts = dict(
+            User._base_manager
+            .annotate(hasher=Case(
+                *when, default=len(prefixes), output_field=IntegerField()))
+            .values_list('hasher')
+            .annotate(count=Count('pk'))
+            .order_by())
+
+        current = counts.get(0, 0) + counts.get(1, 0)
+        total = 0
+        for i, (label, prefix) in enumerate(prefixes + [('other', None)]):
+            total += counts.get(i, 0)
+            self.stdout.write('%-40s %10d' % (label, counts.get(i, 0)))
+        self.stdout.write('%-40s %10d' % ('outdated', total - current))
@@ -0,0 +1,75 @@
+"""
+Delete users in batches, with set-based queries.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from polymorphic_auth import purge
+from polymorphic_auth.models import User
+
+
+class Command(BaseCommand):
+    help = 'Delete inactive users in batches, with set-based queries. ' \
+           'Users must match all of the given selection options.'
+    verb = 'Deleted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--inactive', action='store_true', default=False,
+            help='Select users that are not active.')
+        parser.add_argument(
+            '--last-login-before', metavar='YYYY-MM-DD',
+            help='Select users that have not logged in since this date, or '
+                 'have never logged in and were created before it. Buffered '
+                 'last_login timestamps are written first.')
+        parser.add_argument(
+            '--ids', help='Select users with these comma separated IDs.')
+        parser.add_argument(
+            '--batch-size', default=1000, type=int,
+            help='Number of users to delete in each batch. Default: 1000')
+        parser.add_argument(
+            '--dry-run', action='store_true', default=False,
+            help='Count the rows that would be deleted from each table, '
+                 'without deleting them.')
+
+    def handle(self, *args, **options):
+        last_login_before = None
+        if options['last_login_before']:
+            date = parse_date(options['last_login_before'])
+            if date is None:
+                raise CommandError(
+                    'Invalid date: %s' % options['last_login_before'])
+            last_login_before = datetime.datetime.combine(
+                date, datetime.time.min)
+            if settings.USE_TZ:
+                last_login_before = timezone.make_aware(
+                    last_login_before, timezone.get_default_timezone())
+        ids = None
+        if options['ids']:
+            ids = [int(pk) for pk in options['ids'].split(',')]
+        try:
+            queryset = purge.get_users(
+                inactive=options['inactive'],
+                last_login_before=last_login_before,
+                ids=ids)
+        except ValueError:
+            raise CommandError(
+                'Select users with --inactive, --last-login-before or --ids.')
+        counts = self.run(
+            queryset,
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'])
+        if not counts:
+            self.stdout.write('No users selected.')
+        verb = 'Would delete' if options['dry_run'] else self.verb
+        for table, count in counts.items():
+            self.stdout.write('%s %d rows from %s.' % (verb, count, table))
+
+    def run(self, queryset, batch_size, dry_run):
+        return User.objects.purge(
+            queryset, batch_size=batch_size, dry_run=dry_run)
@@ -0,0 +1,20 @@
+"""
+Rebuild the search entries used by the user admin.
+"""
+
+from django.core.management.base import BaseCommand
+
+from polymorphic_auth import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search entries used by the user admin.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', default=1000, type=int,
+            help='Number of users to index in each chunk. Default: 1000')
+
+    def handle(self, *args, **options):
+        count = search.rebuild_search_index(chunk_size=options['chunk_size'])
+        self.stdout.write('Indexed %d users.' % count)
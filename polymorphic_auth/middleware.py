@@ -0,0 +1,30 @@
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from polymorphic_auth import appsettings, backends, hashing
+
+
+def get_user(request):
+    if not hasattr(request, '_cached_user'):
+        if appsettings.PASSWORD_UPGRADE == 'queue' and \
+                hasattr(request, 'session'):
+            hashing.update_session_auth_hash(request.session)
+        with backends.session_hints(request):
+            request._cached_user = auth.get_user(request)
+    return request._cached_user
+
+
+class PolymorphicAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    Replacement for ``AuthenticationMiddleware`` that lets
+    ``PolymorphicModelBackend`` use the content type ID stored in the session
+    to load the user from its child model table.
+
+    Also keeps sessions authenticated after a queued password upgrade.
+    """
+
+    def process_request(self, request):
+        super(PolymorphicAuthenticationMiddleware, self) \
+            .process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
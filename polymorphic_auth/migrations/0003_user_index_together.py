@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polymorphic_auth', '0002_auto_20160725_2124'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='user',
+            index_together=set([('is_superuser', 'created'), ('is_active', 'created'), ('created', 'id'), ('is_staff', 'created')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import polymorphic_auth.operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polymorphic_auth', '0003_user_index_together'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchEntry',
+            fields=[
+                ('user', models.OneToOneField(related_name='search_entry', primary_key=True, serialize=False, to='polymorphic_auth.User')),
+                ('text', models.TextField(verbose_name='text')),
+            ],
+            options={
+                'verbose_name': 'user search entry',
+                'verbose_name_plural': 'user search entries',
+            },
+        ),
+        polymorphic_auth.operations.CreateTrigramIndex(
+            model_name='usersearchentry',
+            field='text',
+            name='polymorphic_auth_usersearchentry_text_trgm',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0001_initial'),
+        ('polymorphic_auth', '0004_usersearchentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedUser',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('user_id', models.IntegerField(verbose_name='user ID', db_index=True)),
+                ('data', models.TextField(verbose_name='data')),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now, verbose_name='archived', editable=False)),
+                ('content_type', models.ForeignKey(related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+                'verbose_name': 'archived user',
+                'verbose_name_plural': 'archived users',
+            },
+        ),
+    ]
@@ -5,11 +5,16 @@ import re
 import sys
 
 from django import VERSION as django_version
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import \
     AbstractBaseUser, BaseUserManager, PermissionsMixin
+from django.contrib.contenttypes.models import ContentType
 from django.core import validators
+from django.core.exceptions import FieldDoesNotExist
 from django.core.mail import send_mail
-from django.db import models
+from django.db import \
+    IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Q, Value, When
 from django.utils import six, timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
@@ -20,6 +25,9 @@ except ImportError:
      # for django-polymorphic < 0.8
      from polymorphic import PolymorphicModel, PolymorphicManager
 
+from polymorphic_auth import appsettings, hashing
+from polymorphic_auth.instrumentation import instrumented
+
 
 # FIELD MIXINS ################################################################
 
@@ -166,6 +174,41 @@ class UsernameMethodsMixin(object):
 # MANAGERS ####################################################################
 
 
+def _chunked(iterable, size):
+    """
+    Yield lists of up to ``size`` items from ``iterable``.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _set_normalized_usernames(manager, rows, normalized_field, normalize):
+    """
+    Set ``normalized_field`` to ``normalize(username)`` for each
+    ``(pk, username)`` in ``rows``, with one ``UPDATE`` per chunk of rows.
+
+    Values are normalized in Python, like they are on save and lookup, because
+    the database's ``LOWER()`` may not fold non-ASCII characters the same way.
+    """
+    connection = connections[manager.db]
+    field = manager.model._meta.get_field(normalized_field)
+    # Each row takes a parameter for the `IN` clause and two for its `WHEN`.
+    size = connection.ops.bulk_batch_size(['pk', 'when', 'then'], rows)
+    for chunk in _chunked(rows, max(size or len(rows), 1)):
+        manager.filter(pk__in=[pk for pk, username in chunk]).update(**{
+            normalized_field: Case(*[
+                When(pk=pk, then=Value(normalize(username)))
+                for pk, username in chunk
+            ], output_field=field),
+        })
+
+
 class UserManager(PolymorphicManager, BaseUserManager):
     """
     Manager for ``AbstractUser`` models. See:
@@ -173,6 +216,7 @@ class UserManager(PolymorphicManager, BaseUserManager):
     https://docs.djangoproject.com/en/1.8/topics/auth/customizing/#django.contrib.auth.models.CustomUserManager
     """
 
+    @instrumented('create_user')
     def _create_user(self, password, **extra_fields):
         """
         Create a user account with a password.
@@ -196,12 +240,372 @@ class UserManager(PolymorphicManager, BaseUserManager):
         extra_fields.update(is_staff=True, is_superuser=True)
         return self._create_user(password, **extra_fields)
 
+    def aget_by_natural_key(self, username):
+        """
+        Asyncio version of ``get_by_natural_key()``. See ``aio``.
+        """
+        from polymorphic_auth import aio
+        return aio.get_by_natural_key(self, username)
+
+    def acreate_user(self, password, **extra_fields):
+        """
+        Asyncio version of ``create_user()``. See ``aio``.
+        """
+        from polymorphic_auth import aio
+        extra_fields.update(is_staff=False, is_superuser=False)
+        return aio.create_user(self, password, **extra_fields)
+
+    def acreate_superuser(self, password, **extra_fields):
+        """
+        Asyncio version of ``create_superuser()``. See ``aio``.
+        """
+        from polymorphic_auth import aio
+        extra_fields.update(is_staff=True, is_superuser=True)
+        return aio.create_user(self, password, **extra_fields)
+
+    def bulk_create_users(self, rows, batch_size=500, hasher_workers=None):
+        """
+        Create users from an iterable of dicts of field values, skipping rows
+        with a username that matches an existing user or an earlier row.
+        Returns a 2-tuple containing ``created`` and ``skipped`` counts.
+
+        A ``password`` key in each row is hashed, in a pool of
+        ``hasher_workers`` processes if given. Rows without a password get an
+        unusable password.
+
+        Each batch of ``batch_size`` rows is checked for existing usernames
+        with a single query, then inserted into the parent and child tables in
+        a transaction. Child table rows are inserted with multi-row INSERTs.
+        Parent table rows are too on backends that can return the new primary
+        keys (PostgreSQL on Django 1.10+), and one at a time otherwise. Like
+        ``bulk_create()``, this does not call ``save()`` or send ``pre_save``
+        and ``post_save`` signals. Search entries are created in the same
+        transaction if the ``ADMIN_SEARCH_INDEX`` setting is enabled.
+        """
+        db = self._db or router.db_for_write(self.model)
+        created = skipped = 0
+        seen = set()
+        pool = hashing.get_hasher_pool(hasher_workers)
+        try:
+            for batch in _chunked(rows, batch_size):
+                users = []
+                passwords = []
+                for row in batch:
+                    row = dict(row)
+                    passwords.append(row.pop('password', None))
+                    users.append(self.model(**row))
+                # Skip users that already exist or are duplicated in `rows`,
+                # with one query per batch.
+                keys = [self.get_username_key(u.get_username()) for u in users]
+                existing = self.get_existing_usernames(
+                    key for key in keys if key is not None)
+                new_users = []
+                new_passwords = []
+                for user, password, key in zip(users, passwords, keys):
+                    if key is not None:
+                        if key in existing or key in seen:
+                            skipped += 1
+                            continue
+                        seen.add(key)
+                    new_users.append(user)
+                    new_passwords.append(password)
+                if not new_users:
+                    continue
+                encoded = hashing.hash_passwords(new_passwords, pool=pool)
+                for user, password in zip(new_users, encoded):
+                    user.password = password
+                with transaction.atomic(using=db):
+                    self._bulk_insert(new_users, db)
+                    if appsettings.ADMIN_SEARCH_INDEX:
+                        from polymorphic_auth import search
+                        search.index_users(new_users, db)
+                created += len(new_users)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return created, skipped
+
+    def _bulk_insert(self, users, db):
+        """
+        Insert parent and child table rows for ``users``, and assign primary
+        keys.
+        """
+        model = self.model._meta.concrete_model
+        connection = connections[db]
+        ctype = ContentType.objects.db_manager(db).get_for_model(
+            self.model, for_concrete_model=False)
+        for user in users:
+            user.polymorphic_ctype_id = ctype.pk
+            if user.NORMALIZED_USERNAME_FIELD:
+                setattr(user, user.NORMALIZED_USERNAME_FIELD,
+                        user.normalize_username_value(user.get_username()))
+        # Insert rows for the root model first, then each child model in turn.
+        chain = list(reversed(model._meta.get_parent_list())) + [model]
+        root = chain[0]
+        for table_model in chain:
+            fields = [
+                f for f in table_model._meta.local_concrete_fields
+                if not isinstance(f, models.AutoField)
+            ]
+            manager = table_model._base_manager.db_manager(db)
+            size = connection.ops.bulk_batch_size(fields, users) or len(users)
+            if table_model is root:
+                self._insert_root_rows(root, users, fields, db, size)
+                # Child tables use a link to their parent as primary key.
+                for user in users:
+                    pk = getattr(user, root._meta.pk.attname)
+                    for link_model in chain:
+                        setattr(user, link_model._meta.pk.attname, pk)
+                continue
+            for chunk in _chunked(users, max(size, 1)):
+                manager._insert(chunk, fields=fields, using=db)
+        for user in users:
+            user._state.adding = False
+            user._state.db = db
+
+    def _insert_root_rows(self, root, users, fields, db, size):
+        """
+        Insert root model rows for ``users`` and assign their primary keys.
+        """
+        manager = root._base_manager.db_manager(db)
+        if getattr(connections[db].features,
+                   'can_return_ids_from_bulk_insert', False):
+            # Django 1.10+ on PostgreSQL gets primary keys from a multi-row
+            # `INSERT ... RETURNING`.
+            objs = [
+                root(**dict((f.attname, getattr(user, f.attname))
+                            for f in fields))
+                for user in users
+            ]
+            manager.bulk_create(objs, batch_size=max(size, 1))
+            for user, obj in zip(users, objs):
+                setattr(user, root._meta.pk.attname, obj.pk)
+        else:
+            # Other backends can only return the primary key of a single row.
+            for user in users:
+                setattr(user, root._meta.pk.attname, manager._insert(
+                    [user], fields=fields, return_id=True, using=db))
+
+    def convert_type(self, queryset, target_model, field_map=None,
+                     batch_size=1000):
+        """
+        Convert the users in ``queryset`` to ``target_model``, another child
+        model of the same parent model, without loading model instances.
+        Returns the number of users converted.
+
+        ``field_map`` maps target model field names to source model field
+        names. Other target fields get their default value. The parent rows,
+        primary keys, groups and permissions are kept. ``ValueError`` is
+        raised for a name that is not a field of a new table or of the source
+        model.
+
+        Each batch of ``batch_size`` users is converted in a transaction with
+        set-based queries: an ``INSERT ... SELECT`` into each new child table,
+        one ``UPDATE`` of ``polymorphic_ctype``, then a ``DELETE`` from each old
+        child table. Rows in other tables that reference the old child tables
+        must be removed first. Search entries are replaced if the
+        ``ADMIN_SEARCH_INDEX`` setting is enabled.
+        """
+        from polymorphic_auth import caching
+        field_map = field_map or {}
+        source_model = queryset.model._meta.concrete_model
+        target_model = target_model._meta.concrete_model
+        db = queryset.db
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        source_chain = list(reversed(source_model._meta.get_parent_list())) \
+            + [source_model]
+        target_chain = list(reversed(target_model._meta.get_parent_list())) \
+            + [target_model]
+        root = source_chain[0]
+        if root is not target_chain[0] or source_model is target_model:
+            raise ValueError(
+                '%s and %s must be different child models of the same parent '
+                'model.' % (source_model.__name__, target_model.__name__))
+        insert_models = [m for m in target_chain if m not in source_chain]
+        delete_models = [m for m in reversed(source_chain)
+                         if m not in target_chain]
+        insert_fields = set(
+            field.name for m in insert_models
+            for field in m._meta.local_concrete_fields
+            if not field.primary_key)
+        for name, source_name in field_map.items():
+            if name not in insert_fields:
+                raise ValueError(
+                    '%r in field_map is not a field of a %s table that is '
+                    'not shared with %s.' % (
+                        name, target_model.__name__, source_model.__name__))
+            try:
+                source_field = source_model._meta.get_field(source_name)
+            except FieldDoesNotExist:
+                source_field = None
+            if source_field is None or not source_field.concrete:
+                raise ValueError(
+                    '%r in field_map is not a concrete field of %s.' % (
+                        source_name, source_model.__name__))
+
+        # Join every source table on the shared primary key value.
+        root_pk = '%s.%s' % (
+            qn(root._meta.db_table), qn(root._meta.pk.column))
+        from_sql = qn(root._meta.db_table) + ''.join(
+            ' INNER JOIN %s ON %s.%s = %s' % (
+                qn(m._meta.db_table), qn(m._meta.db_table),
+                qn(m._meta.pk.column), root_pk)
+            for m in source_chain[1:])
+
+        # Build an `INSERT ... SELECT` for each new table, with placeholders
+        # for default values.
+        inserts = []
+        for table_model in insert_models:
+            columns = [qn(table_model._meta.pk.column)]
+            select = [root_pk]
+            params = []
+            for field in table_model._meta.local_concrete_fields:
+                if field.primary_key:
+                    continue
+                columns.append(qn(field.column))
+                if field.name in field_map:
+                    source_field = source_model._meta.get_field(
+                        field_map[field.name])
+                    select.append('%s.%s' % (
+                        qn(source_field.model._meta.db_table),
+                        qn(source_field.column)))
+                else:
+                    select.append('%s')
+                    params.append(field.get_db_prep_save(
+                        field.get_default(), connection=connection))
+            inserts.append((
+                'INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s IN ' % (
+                    qn(table_model._meta.db_table), ', '.join(columns),
+                    ', '.join(select), from_sql, root_pk),
+                params))
+
+        ctypes = ContentType.objects.db_manager(db)
+        source_ctype = ctypes.get_for_model(
+            source_model, for_concrete_model=False)
+        target_ctype = ctypes.get_for_model(
+            target_model, for_concrete_model=False)
+        pks = queryset.non_polymorphic() \
+            .filter(polymorphic_ctype=source_ctype) \
+            .order_by('pk').values_list('pk', flat=True)
+        # Leave room for default value parameters in the largest query.
+        extra = max([len(params) for sql, params in inserts] or [0])
+        limit = connection.ops.bulk_batch_size(
+            ['pk'], range(batch_size + extra))
+        if limit:
+            batch_size = max(min(batch_size, limit - extra), 1)
+        converted = 0
+        last_pk = None
+        while True:
+            batch = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            placeholders = '(%s)' % ', '.join(['%s'] * len(batch))
+            with transaction.atomic(using=db):
+                with connection.cursor() as cursor:
+                    for sql, params in inserts:
+                        cursor.execute(sql + placeholders, params + batch)
+                    root._base_manager.using(db).filter(pk__in=batch) \
+                        .update(polymorphic_ctype=target_ctype)
+                    for table_model in delete_models:
+                        cursor.execute(
+                            'DELETE FROM %s WHERE %s IN %s' % (
+                                qn(table_model._meta.db_table),
+                                qn(table_model._meta.pk.column),
+                                placeholders),
+                            batch)
+                normalized_field = getattr(
+                    target_model, 'NORMALIZED_USERNAME_FIELD', None)
+                if normalized_field and normalized_field not in field_map:
+                    manager = target_model._base_manager.db_manager(db)
+                    _set_normalized_usernames(
+                        manager,
+                        list(manager.filter(pk__in=batch).values_list(
+                            'pk', target_model.USERNAME_FIELD)),
+                        normalized_field,
+                        target_model.normalize_username_value)
+                if appsettings.ADMIN_SEARCH_INDEX:
+                    from polymorphic_auth import search
+                    search.reindex_users(batch, db)
+            caching.invalidate_users(batch)
+            converted += len(batch)
+            last_pk = batch[-1]
+        return converted
+
+    def purge(self, queryset, batch_size=1000, dry_run=False):
+        """
+        Delete the users in ``queryset`` in batches of ``batch_size``, with
+        set-based queries and without loading model instances. See ``purge``.
+        """
+        from polymorphic_auth import purge
+        return purge.purge_users(queryset, batch_size, dry_run)
+
+    def archive(self, queryset, batch_size=1000, dry_run=False):
+        """
+        Like ``purge()``, but copy the users to ``ArchivedUser`` first.
+        """
+        from polymorphic_auth import purge
+        return purge.archive_users(queryset, batch_size, dry_run)
+
+    def restore(self, archived_queryset, batch_size=1000):
+        """
+        Restore users archived with ``archive()``.
+        """
+        from polymorphic_auth import purge
+        return purge.restore_users(archived_queryset, batch_size)
+
+    def get_username_key(self, username):
+        """
+        Return the value used to compare ``username`` with existing users, as
+        returned by ``get_existing_usernames()``.
+        """
+        if username is None:
+            return None
+        if self.model.IS_USERNAME_CASE_INSENSITIVE:
+            return self.model.normalize_username_value(username)
+        return username
+
+    def get_existing_usernames(self, usernames):
+        """
+        Return the set of ``usernames`` that match existing users, with a
+        single query. Usernames for case-insensitive user types are returned
+        as normalized by ``normalize_username_value()``.
+        """
+        keys = set(self.get_username_key(u) for u in usernames)
+        keys.discard(None)
+        if not keys:
+            return set()
+        if self.model.NORMALIZED_USERNAME_FIELD:
+            field = self.model.NORMALIZED_USERNAME_FIELD
+        elif self.model.IS_USERNAME_CASE_INSENSITIVE:
+            # Match like `get_by_natural_key()` does, and normalize the
+            # matching usernames in Python.
+            field = self.model.USERNAME_FIELD
+            q = Q()
+            for key in keys:
+                q |= Q(**{'%s__iexact' % field: key})
+            return set(
+                self.model.normalize_username_value(username)
+                for username in self.filter(q).values_list(field, flat=True))
+        else:
+            field = self.model.USERNAME_FIELD
+        return set(self.filter(**{'%s__in' % field: keys})
+                   .values_list(field, flat=True))
+
+    @instrumented('get_by_natural_key')
     def get_by_natural_key(self, username):
         """
         Override default user lookup behaviour to match username (really email)
         field with case INsensitivity for email-address based users.
+
+        Models with a ``NORMALIZED_USERNAME_FIELD`` are matched by equality on
+        that field, which can use its index.
         """
-        if getattr(self.model, 'IS_USERNAME_CASE_INSENSITIVE', False):
+        if getattr(self.model, 'NORMALIZED_USERNAME_FIELD', None):
+            return self.get(**self.model.get_username_filter(username))
+        elif getattr(self.model, 'IS_USERNAME_CASE_INSENSITIVE', False):
             return self.get(**{
                 '%s__iexact' % self.model.USERNAME_FIELD: username.lower()
             })
@@ -225,6 +629,17 @@ class AbstractUser(PolymorphicModel, AbstractBaseUser):
 
     IS_USERNAME_CASE_INSENSITIVE = False
 
+    # Name of a field that stores a case-folded copy of the username field, for
+    # case-insensitive user types. When set, lookups are done by equality on
+    # this field instead of with a (non-indexable) `iexact` filter.
+    NORMALIZED_USERNAME_FIELD = None
+
+    # Set to `True` when the database enforces a unique constraint on
+    # `NORMALIZED_USERNAME_FIELD` for all rows (i.e. after existing rows have
+    # been backfilled). Duplicate usernames are then detected by catching an
+    # `IntegrityError` on save, instead of with a query before every save.
+    IS_NORMALIZED_USERNAME_UNIQUE = False
+
     class Meta:
         abstract = True
         verbose_name = _('user with ID login')
@@ -233,14 +648,67 @@ class AbstractUser(PolymorphicModel, AbstractBaseUser):
     def __str__(self):
         return six.text_type(self.get_username())
 
+    @instrumented('set_password')
+    def set_password(self, raw_password):
+        super(AbstractUser, self).set_password(raw_password)
+
+    def check_password(self, raw_password):
+        """
+        Queue outdated password hashes for upgrade in a background thread,
+        instead of rehashing and saving the user, if the ``PASSWORD_UPGRADE``
+        setting is ``'queue'``. Sessions are only kept authenticated after the
+        upgrade by ``PolymorphicAuthenticationMiddleware``.
+        """
+        if appsettings.PASSWORD_UPGRADE != 'queue':
+            return super(AbstractUser, self).check_password(raw_password)
+
+        def setter(raw_password):
+            hashing.queue_password_upgrade(self, raw_password)
+
+        return check_password(raw_password, self.password, setter)
+
+    @classmethod
+    def normalize_username_value(cls, username):
+        """
+        Return the value to store in ``NORMALIZED_USERNAME_FIELD`` for the
+        given username.
+        """
+        if username is None:
+            return None
+        return six.text_type(username).lower()
+
+    @classmethod
+    def get_username_filter(cls, username):
+        """
+        Return filter kwargs that match users with the given username, with
+        case INsensitivity for case-insensitive user types.
+        """
+        if cls.NORMALIZED_USERNAME_FIELD:
+            return {
+                cls.NORMALIZED_USERNAME_FIELD:
+                    cls.normalize_username_value(username),
+            }
+        elif cls.IS_USERNAME_CASE_INSENSITIVE:
+            return {'%s__iexact' % cls.USERNAME_FIELD: username}
+        return {cls.USERNAME_FIELD: username}
+
     @classmethod
-    def try_create(cls, _stdout=sys.stdout, **kwargs):
+    @instrumented('try_create')
+    def try_create(
+            cls, _stdout=sys.stdout, _unusable_password=False,
+            _defer_hashing=False, _encoded_password=None, **kwargs):
         """
         Creates a user account, if it does not already exist. Returns a 2-tuple
         containing the user and a ``created`` boolean.
 
         You must provide all required fields as ``kwargs``. If no password is
-        given, one will be randomly generated.
+        given, one will be randomly generated, unless ``_unusable_password`` is
+        true. Passwords are only generated and hashed when a user is created.
+
+        If ``_defer_hashing`` is true, the user is saved with an unusable
+        password and the password is hashed in a background thread. See
+        ``hashing.wait_for_deferred_passwords()``. If ``_encoded_password`` is
+        given, it is stored instead of hashing ``password`` again.
 
         Credentials and field values will be written to ``_stdout``.
         """
@@ -248,21 +716,32 @@ class AbstractUser(PolymorphicModel, AbstractBaseUser):
         # can easily override it to provide additional or derived fields. For
         # example, deriving a username from a name or email address.
         username = kwargs.pop(cls.USERNAME_FIELD)
-        password = kwargs.pop('password', cls.objects.make_random_password(
-            length=random.randint(19, 28)))
+        has_password = 'password' in kwargs
+        password = kwargs.pop('password', None)
         try:
             return cls.objects.get(**{cls.USERNAME_FIELD: username}), False
         except cls.DoesNotExist:
+            if _unusable_password:
+                password = None
+            elif not has_password:
+                password = cls.objects.make_random_password(
+                    length=random.randint(19, 28))
             user = cls()
             setattr(user, cls.USERNAME_FIELD, username)
-            user.set_password(password)
+            if password is None or _defer_hashing:
+                user.set_unusable_password()
+            elif _encoded_password is not None:
+                user.password = _encoded_password
+            else:
+                user.set_password(password)
             # Collect output into a dict to be written to `_stdout` after the
             # user is saved. We have to do that last in case the username field
             # is an `AutoField`.
             out = [
                 'Created user account:',
                 '  {}: {{}}'.format(cls.USERNAME_FIELD),
-                '  password: {}'.format(password),
+                '  password: {}'.format(
+                    '(unusable)' if password is None else password),
             ]
             for key, value in kwargs.items():
                 # Only assign values to known attributes, in case `kwargs`
@@ -271,10 +750,28 @@ class AbstractUser(PolymorphicModel, AbstractBaseUser):
                     setattr(user, key, value)
                     out.append('  {}: {}'.format(key, value))
             user.save()
+            if password is not None and _defer_hashing:
+                hashing.defer_set_password(user, password)
             # Write output to `_stdout`, now that we know the username.
             print('\n'.join(out).format(user.get_username()), file=_stdout)
             return user, True
 
+    @classmethod
+    def atry_create(cls, **kwargs):
+        """
+        Asyncio version of ``try_create()``. See ``aio``.
+        """
+        from polymorphic_auth import aio
+        return aio.try_create(cls, **kwargs)
+
+    def acheck_password(self, raw_password):
+        """
+        Asyncio version of ``check_password()``, which does not upgrade the
+        password hash. See ``aio``.
+        """
+        from polymorphic_auth import aio
+        return aio.check_user_password(self, raw_password)
+
 
 class AbstractAdminUser(
         NameMethodsMixin, AbstractUser, AdminFieldsMixin, NameFieldsMixin,
@@ -289,23 +786,65 @@ class AbstractAdminUser(
     class Meta:
         abstract = True
 
+    @instrumented('save')
     def save(self, *args, **kwargs):
         # Hack to force check for potential duplicate users before save, in
         # case more user-friendly validation sanity checks have not been
         # implemented or have been bypassed.
         if self.IS_USERNAME_CASE_INSENSITIVE:
-            matching_users = type(self).objects.filter(**{
-                '%s__iexact' % self.USERNAME_FIELD: self.username
-            })
-            if self.pk:
-                matching_users = matching_users.exclude(pk=self.pk)
-            if matching_users:
-                raise Exception(
-                    u"Identifier field %s='%s' matches existing users: %s"
-                    % (self.USERNAME_FIELD, self.username, matching_users))
+            if self.NORMALIZED_USERNAME_FIELD and \
+                    self.IS_NORMALIZED_USERNAME_UNIQUE:
+                # Let the database check for duplicates.
+                self._save_with_username_constraint(*args, **kwargs)
+                return
+            if self._get_username_clashes(kwargs.get('using')).exists():
+                self._raise_username_clash()
 
         super(AbstractAdminUser, self).save(*args, **kwargs)
 
+    def _get_username_clashes(self, using=None):
+        """
+        Return a queryset of other users with a matching username.
+        """
+        matching_users = type(self).objects.filter(
+            **self.get_username_filter(self.get_username()))
+        if using:
+            matching_users = matching_users.using(using)
+        if self.pk:
+            matching_users = matching_users.exclude(pk=self.pk)
+        return matching_users
+
+    def _raise_username_clash(self):
+        raise Exception(
+            u"Identifier field %s='%s' matches existing users"
+            % (self.USERNAME_FIELD, self.get_username()))
+
+    def _save_with_username_constraint(self, *args, **kwargs):
+        """
+        Save in a savepoint and convert an ``IntegrityError`` caused by a
+        duplicate username into the same error raised by the pre-save check.
+        """
+        using = kwargs.get('using') or \
+            router.db_for_write(type(self), instance=self)
+        # A failed insert into the child table leaves primary keys assigned
+        # from the (rolled back) parent insert. Remember them, so the instance
+        # can be restored and saved again.
+        adding = self._state.adding
+        pk_fields = [self._meta.pk] + [
+            parent._meta.pk for parent in self._meta.get_parent_list()]
+        pk_values = [(f.attname, getattr(self, f.attname)) for f in pk_fields]
+        try:
+            with transaction.atomic(using=using):
+                super(AbstractAdminUser, self).save(*args, **kwargs)
+        except IntegrityError:
+            self._state.adding = adding
+            for attname, value in pk_values:
+                setattr(self, attname, value)
+            # Only check for a clash after the constraint has been violated.
+            if self._get_username_clashes(using).exists():
+                self._raise_username_clash()
+            raise
+
 
 # Monkey-patch Django 1.7's `AbstractBaseUser` fields to match the field
 # settings as applied in Django 1.8, to make our `AbstractAdminUser` model
@@ -325,3 +864,53 @@ if django_version >= (1, 7) and django_version < (1, 8):
 
 class User(AbstractAdminUser):
     objects = UserManager()
+
+    class Meta(AbstractAdminUser.Meta):
+        # Support keyset pagination and `list_filter` in the admin.
+        index_together = (
+            ('created', 'id'),
+            ('is_active', 'created'),
+            ('is_staff', 'created'),
+            ('is_superuser', 'created'),
+        )
+
+
+@python_2_unicode_compatible
+class UserSearchEntry(models.Model):
+    """
+    Denormalized, lower case text for each user, so the admin can search one
+    table instead of joining every child model table. See ``search``.
+    """
+
+    user = models.OneToOneField(
+        User, primary_key=True, related_name='search_entry')
+    text = models.TextField(_('text'))
+
+    class Meta:
+        verbose_name = _('user search entry')
+        verbose_name_plural = _('user search entries')
+
+    def __str__(self):
+        return self.text
+
+
+@python_2_unicode_compatible
+class ArchivedUser(models.Model):
+    """
+    Table rows, groups and permissions of a user removed by
+    ``UserManager.archive()``, as JSON, so the user can be restored with
+    ``UserManager.restore()``. See ``purge``.
+    """
+
+    user_id = models.IntegerField(_('user ID'), db_index=True)
+    content_type = models.ForeignKey(ContentType, related_name='+')
+    data = models.TextField(_('data'))
+    archived = models.DateTimeField(
+        _('archived'), default=timezone.now, editable=False)
+
+    class Meta:
+        verbose_name = _('archived user')
+        verbose_name_plural = _('archived users')
+
+    def __str__(self):
+        return six.text_type(self.user_id)
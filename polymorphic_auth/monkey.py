@@ -1,11 +1,21 @@
 from django.apps import apps as django_apps
 from django.contrib import auth
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.six.moves import reload_module
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:
+    # Django < 1.8.
+    from django.test.signals import setting_changed
 
 from polymorphic_auth import appsettings
 
+# The resolved user model, once the app registry has loaded all models.
+_user_model_cache = {}
 
-def _get_user_model():
+
+def _resolve_user_model():
     """
     Returns the User model that is active in this project.
     """
@@ -21,8 +31,43 @@ def _get_user_model():
         )
 
 
+def _get_user_model():
+    """
+    Returns the User model that is active in this project, resolving it only
+    once after all models are loaded.
+    """
+    try:
+        return _user_model_cache['model']
+    except KeyError:
+        model = _resolve_user_model()
+        if django_apps.models_ready:
+            _user_model_cache['model'] = model
+        return model
+
+
+def clear_user_model_cache():
+    """
+    Clear the resolved user model, so it will be resolved again on the next
+    call to ``get_user_model()``.
+    """
+    _user_model_cache.clear()
+
+
+def _user_model_setting_changed(setting, **kwargs):
+    """
+    Reload app settings and clear the resolved user model when settings are
+    overridden in tests.
+    """
+    if setting in ('AUTH_USER_MODEL', 'POLYMORPHIC_AUTH'):
+        reload_module(appsettings)
+        clear_user_model_cache()
+
+
 def patch_get_user_model():
     """
     Get the polymorphic `DEFAULT_CHILD_MODEL` instead of the `AUTH_USER_MODEL`.
     """
     auth.get_user_model = _get_user_model
+    setting_changed.connect(
+        _user_model_setting_changed,
+        dispatch_uid='polymorphic_auth.monkey._user_model_setting_changed')
@@ -0,0 +1,138 @@
+"""
+Migration operations for ``polymorphic_auth`` user types.
+"""
+
+from django.apps import apps as global_apps
+from django.db import migrations
+from django.db.migrations.operations.base import Operation
+from django.utils import six
+
+
+class BackfillNormalizedUsername(migrations.RunPython):
+    """
+    Populate a ``NORMALIZED_USERNAME_FIELD`` from its username field for
+    existing rows, in batches of ``batch_size`` primary keys.
+
+    Only the primary key and username of each batch are loaded. They are
+    normalized in Python with the model's ``normalize_username_value()``, like
+    on save and lookup, and written with one ``UPDATE`` per batch. This will
+    fail with an ``IntegrityError`` if existing usernames differ only by case,
+    which must be resolved before the backfill can run.
+    """
+
+    def __init__(self, model_name, field, normalized_field, batch_size=1000,
+                 **kwargs):
+        self.model_name = model_name
+        self.field = field
+        self.normalized_field = normalized_field
+        self.batch_size = batch_size
+        super(BackfillNormalizedUsername, self).__init__(
+            self.backfill, migrations.RunPython.noop, **kwargs)
+
+    def deconstruct(self):
+        kwargs = {
+            'model_name': self.model_name,
+            'field': self.field,
+            'normalized_field': self.normalized_field,
+            'batch_size': self.batch_size,
+        }
+        if self.hints:
+            kwargs['hints'] = self.hints
+        return (self.__class__.__name__, [], kwargs)
+
+    def describe(self):
+        return 'Backfill %s.%s from %s' % (
+            self.model_name, self.normalized_field, self.field)
+
+    def backfill(self, apps, schema_editor):
+        """
+        Update rows that have not yet been normalized, walking the table by
+        primary key.
+        """
+        from polymorphic_auth.models import _set_normalized_usernames
+        model = apps.get_model(self.app_label, self.model_name)
+        manager = model._base_manager.db_manager(schema_editor.connection.alias)
+        normalize = self.get_normalize_function()
+        pending = manager.filter(**{
+            '%s__isnull' % self.normalized_field: True,
+        }).order_by('pk')
+        last_pk = None
+        while True:
+            batch = pending
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            rows = list(
+                batch.values_list('pk', self.field)[:self.batch_size])
+            if not rows:
+                break
+            _set_normalized_usernames(
+                manager, rows, self.normalized_field, normalize)
+            last_pk = rows[-1][0]
+
+    def get_normalize_function(self):
+        """
+        Return the ``normalize_username_value()`` of the current model, which
+        historical models don't have, so stored values match lookups.
+        """
+        try:
+            model = global_apps.get_model(self.app_label, self.model_name)
+        except LookupError:
+            model = None
+        normalize = getattr(model, 'normalize_username_value', None)
+        if normalize is None:
+            def normalize(username):
+                if username is None:
+                    return None
+                return six.text_type(username).lower()
+        return normalize
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        # Remember the app label of the migration being applied, so the model
+        # can be looked up from the migration state by name.
+        self.app_label = app_label
+        super(BackfillNormalizedUsername, self).database_forwards(
+            app_label, schema_editor, from_state, to_state)
+
+
+class CreateTrigramIndex(Operation):
+    """
+    Create a trigram GIN index on ``field`` for ``LIKE '%term%'`` searches.
+    This is a no-op on databases other than PostgreSQL.
+    """
+
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, model_name, field, name):
+        self.model_name = model_name
+        self.field = field
+        self.name = name
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        model = to_state.apps.get_model(app_label, self.model_name)
+        quote_name = schema_editor.quote_name
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            'CREATE INDEX %s ON %s USING gin (%s gin_trgm_ops)' % (
+                quote_name(self.name),
+                quote_name(model._meta.db_table),
+                quote_name(model._meta.get_field(self.field).column),
+            ))
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        schema_editor.execute(
+            'DROP INDEX IF EXISTS %s' % schema_editor.quote_name(self.name))
+
+    def describe(self):
+        return 'Create trigram index %s on %s.%s' % (
+            self.name, self.model_name, self.field)
@@ -0,0 +1,165 @@
+"""
+Paginators for admin changelists on large user tables.
+
+``EstimatedCountPaginator`` uses the database's estimated row count instead of
+``COUNT(*)`` when there are more than ``ADMIN_ESTIMATED_COUNT_THRESHOLD`` rows.
+
+``KeysetPaginator`` also seeks to the next page with a filter on the ordering
+fields of the last row of the previous page (e.g. ``(created, id)``), instead
+of scanning and discarding rows with ``OFFSET``.
+"""
+
+import functools
+import hashlib
+import json
+import operator
+
+from django.core.cache import caches
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import six
+from django.utils.functional import cached_property
+
+from polymorphic_auth import appsettings
+
+BOUNDARY_KEY = 'polymorphic_auth:page:%s:%s'
+
+
+def get_estimated_count(queryset):
+    """
+    Return the database's estimate of the number of rows in ``queryset``, or
+    ``None`` if the database can't provide one.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                # Maintained by `VACUUM` and `ANALYZE`.
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table])
+            else:
+                sql, params = queryset.query.get_compiler(
+                    using=queryset.db).as_sql()
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        if queryset.query.where:
+            plan = row[0]
+            if isinstance(plan, six.string_types):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        # Tables that have never been analyzed have a negative estimate.
+        return row[0] if row[0] >= 0 else None
+    if connection.vendor == 'mysql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT table_rows FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() AND table_name = %s',
+                [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        return row and row[0]
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Use an estimated count above ``ADMIN_ESTIMATED_COUNT_THRESHOLD`` rows, and
+    an exact count below it or when no estimate is available.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = get_estimated_count(self.object_list)
+        if estimate is not None \
+                and estimate >= appsettings.ADMIN_ESTIMATED_COUNT_THRESHOLD:
+            return estimate
+        return self.object_list.count()
+
+
+class KeysetPaginator(EstimatedCountPaginator):
+    """
+    Seek to each page after the first with a filter on the ordering field
+    values of the last row of the previous page, which are cached when the
+    previous page is loaded.
+
+    Pages that are not reached from the previous page (e.g. when jumping to
+    the last page), and querysets that are not ordered by non-nullable local
+    fields ending in the primary key, are loaded with ``OFFSET`` instead.
+    """
+
+    def page(self, number):
+        number = self.validate_number(number)
+        ordering = self.get_keyset_ordering()
+        boundary = None
+        if ordering and number > 1:
+            boundary = self.get_cache().get(self.get_boundary_key(number))
+        if boundary is None:
+            bottom = (number - 1) * self.per_page
+            top = bottom + self.per_page
+            if top + self.orphans >= self.count:
+                top = self.count
+            object_list = list(self.object_list[bottom:top])
+        else:
+            object_list = list(self.seek(ordering, boundary)[:self.per_page])
+        if ordering and object_list:
+            self.get_cache().set(
+                self.get_boundary_key(number + 1),
+                [getattr(object_list[-1], field.attname)
+                 for field, descending in ordering],
+                appsettings.ADMIN_PAGINATION_CACHE_TIMEOUT)
+        return Page(object_list, number, self)
+
+    def get_cache(self):
+        return caches[appsettings.ADMIN_PAGINATION_CACHE]
+
+    def get_boundary_key(self, number):
+        """
+        Return a cache key for the boundary of page ``number``, for the SQL of
+        the queryset.
+        """
+        sql, params = self.object_list.query.get_compiler(
+            using=self.object_list.db).as_sql()
+        digest = hashlib.md5(six.text_type(
+            (sql, params, self.per_page)).encode('utf-8')).hexdigest()
+        return BOUNDARY_KEY % (digest, number)
+
+    def get_keyset_ordering(self):
+        """
+        Return a list of ``(field, descending)`` tuples for the ordering of the
+        queryset, or ``None`` if it can't be used as a keyset.
+        """
+        opts = self.object_list.model._meta
+        ordering = []
+        for name in self.object_list.query.order_by:
+            if not isinstance(name, six.string_types) or '__' in name:
+                return None
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.null:
+                return None
+            ordering.append((field, descending))
+        if not ordering or ordering[-1][0] is not opts.pk:
+            return None
+        return ordering
+
+    def seek(self, ordering, boundary):
+        """
+        Filter the queryset to rows after ``boundary`` in ``ordering``.
+        """
+        steps = []
+        for i, (field, descending) in enumerate(ordering):
+            lookup = '%s__%s' % (field.attname, 'lt' if descending else 'gt')
+            step = Q(**{lookup: boundary[i]})
+            for (previous, _), value in zip(ordering[:i], boundary):
+                step &= Q(**{previous.attname: value})
+            steps.append(step)
+        return self.object_list.filter(functools.reduce(operator.or_, steps))
@@ -1,6 +1,99 @@
 import inspect
+from collections import OrderedDict
+from importlib import import_module
+
 from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
+from django.utils import six
+from django.utils.module_loading import import_string
+
+try:
+    from types import MappingProxyType as frozendict
+except ImportError:
+    # Python 2.
+    frozendict = dict
+
+
+# REGISTRY ####################################################################
+
+
+class PluginList(object):
+    """
+    Ordered, list-like registry of plugin classes, indexed by the keys each
+    plugin returns from ``get_index_keys()``. Plugins are appended, removed
+    and looked up by key in constant time. ``version`` changes whenever
+    plugins are added or removed, so cached instances can be invalidated.
+    """
+
+    def __init__(self, plugins=()):
+        self._plugins = OrderedDict()
+        self._index = {}
+        self.version = 0
+        self.extend(plugins)
+
+    def __iter__(self):
+        return iter(self._plugins)
+
+    def __len__(self):
+        return len(self._plugins)
+
+    def __contains__(self, plugin):
+        return plugin in self._plugins
+
+    def __getitem__(self, index):
+        return list(self._plugins)[index]
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, plugin):
+        """
+        Add a plugin class, unless it is already registered.
+        """
+        if plugin in self._plugins:
+            return
+        self._plugins[plugin] = None
+        for key in getattr(plugin, 'get_index_keys', tuple)():
+            self._index.setdefault(key, OrderedDict())[plugin] = None
+        self.version += 1
+
+    def extend(self, plugins):
+        for plugin in plugins:
+            self.append(plugin)
+
+    def remove(self, plugin):
+        """
+        Remove a plugin class. Raises ``ValueError`` if it is not registered.
+        """
+        if plugin not in self._plugins:
+            raise ValueError('%r is not registered.' % plugin)
+        del self._plugins[plugin]
+        for key in getattr(plugin, 'get_index_keys', tuple)():
+            plugins = self._index.get(key)
+            if plugins is not None:
+                plugins.pop(plugin, None)
+                if not plugins:
+                    del self._index[key]
+        self.version += 1
+
+    def get_indexed(self, key):
+        """
+        Return a list of plugin classes indexed by ``key``, in registration
+        order.
+        """
+        return list(self._index.get(key, ()))
 
 
 # METACLASSES #################################################################
@@ -27,18 +120,86 @@ class PluginMount(type):
             # So, since this is a new plugin type, not an implementation, this
             # class shouldn't be registered as a plugin. Instead, it sets up a
             # list where plugins can be registered later.
-            cls.plugins = []
+            cls.plugins = PluginList()
+            # Plugin instances and lookups that need the database are cached
+            # here, and shared with plugin implementations. The cache is
+            # cleared when the version of the list of plugins changes.
+            cls._plugin_cache = {}
+            # Modules that define plugins, imported on first use of the mount
+            # point. See `add_plugin_modules()`.
+            cls._pending_modules = []
         else:
             # This must be a plugin implementation, which should be registered.
-            # Simply appending it to the list is all that's needed to keep
-            # track of it later.
-            cls.plugins.append(cls)
+            cls.register_plugin(cls)
+
+    def add_plugin_modules(cls, *modules):
+        """
+        Import the given modules, which register plugins, on first use of the
+        mount point instead of now. Call ``load_plugin_modules()`` before
+        reading the ``plugins`` list directly.
+        """
+        cls._pending_modules.extend(modules)
+        cls.clear_plugin_cache()
+
+    def load_plugin_modules(cls):
+        """
+        Import modules added with ``add_plugin_modules()``.
+        """
+        while cls._pending_modules:
+            import_module(cls._pending_modules.pop(0))
+
+    def register_plugin(cls, plugin):
+        """
+        Append a plugin class to the ``plugins`` list.
+        """
+        cls.plugins.append(plugin)
+
+    def remove_plugin(cls, plugin):
+        """
+        Remove a plugin class from the ``plugins`` list, if registered.
+        """
+        if plugin in cls.plugins:
+            cls.plugins.remove(plugin)
+
+    def get_plugin_cache(cls):
+        """
+        Return the cache for plugin instances and lookups, after importing
+        pending plugin modules. The cache is cleared if plugins were added to
+        or removed from the ``plugins`` list since it was filled.
+        """
+        cls.load_plugin_modules()
+        version = cls.plugins.version
+        if cls._plugin_cache.get('version') != version:
+            cls._plugin_cache.clear()
+            cls._plugin_cache['version'] = version
+        return cls._plugin_cache
+
+    def get_indexed_plugins(cls, key):
+        """
+        Return a list of plugin classes indexed by ``key`` (see
+        ``get_index_keys()``), in registration order.
+        """
+        cls.load_plugin_modules()
+        return cls.plugins.get_indexed(key)
 
     def get_plugins(cls, *args, **kwargs):
         """
-        Return a list of plugin instances and pass through arguments.
+        Return a list of plugin instances and pass through arguments. Plugin
+        instances created without arguments are cached.
+        """
+        cache = cls.get_plugin_cache()
+        if args or kwargs:
+            return [plugin(*args, **kwargs) for plugin in cls.plugins]
+        if 'instances' not in cache:
+            cache['instances'] = tuple(plugin() for plugin in cls.plugins)
+        return list(cache['instances'])
+
+    def clear_plugin_cache(cls):
+        """
+        Clear cached plugin instances and content type lookups. Call this in
+        tests that change content types.
         """
-        return [plugin(*args, **kwargs) for plugin in cls.plugins]
+        cls._plugin_cache.clear()
 
 
 # BASE PLUGIN MOUNT POINTS ####################################################
@@ -54,6 +215,8 @@ class BaseChildModelPlugin(object):
     """
 
     model = None
+    # A model admin class, or its dotted path to import it when the admin
+    # first asks for it. See `get_model_admin()`.
     model_admin = None
 
     @property
@@ -61,7 +224,9 @@ class BaseChildModelPlugin(object):
         """
         Return the ``ContentType`` for the model.
         """
-        return ContentType.objects.get_for_model(self.model)
+        if not hasattr(self, '_content_type'):
+            self._content_type = ContentType.objects.get_for_model(self.model)
+        return self._content_type
 
     @property
     def verbose_name(self):
@@ -71,19 +236,95 @@ class BaseChildModelPlugin(object):
         """
         return self.model._meta.verbose_name
 
+    @classmethod
+    def get_model_admin(cls):
+        """
+        Return the model admin class, importing it if ``model_admin`` is a
+        dotted path.
+        """
+        if isinstance(cls.model_admin, six.string_types):
+            return import_string(cls.model_admin)
+        return cls.model_admin
+
+    @classmethod
+    def get_plugins_by_model(cls):
+        """
+        Return a read-only dict of plugin instances, keyed by model.
+        """
+        cache = cls.get_plugin_cache()
+        if 'by_model' not in cache:
+            plugins = {}
+            for plugin in cls.get_plugins():
+                plugins.setdefault(plugin.model, plugin)
+            cache['by_model'] = frozendict(plugins)
+        return cache['by_model']
+
+    @classmethod
+    def get_plugins_by_content_type(cls):
+        """
+        Return a read-only dict of plugin instances, keyed by content type ID.
+        """
+        cache = cls.get_plugin_cache()
+        if 'by_content_type' not in cache:
+            plugins = {}
+            for plugin in cls.get_plugins():
+                plugins.setdefault(plugin.content_type.pk, plugin)
+            cache['by_content_type'] = frozendict(plugins)
+        return cache['by_content_type']
+
+    @classmethod
+    def get_index_keys(cls):
+        """
+        Return keys to index the plugin by: the model class and its
+        ``app_label.model_name`` label.
+        """
+        if cls.model is None:
+            return ()
+        opts = cls.model._meta
+        return (cls.model, '%s.%s' % (opts.app_label, opts.model_name))
+
     @classmethod
     def get_plugin_for_model(cls, model):
-        for plugin in cls.plugins:
-            if plugin.model == model:
-                return plugin
+        """
+        Return the first registered plugin class for a model, or ``None``.
+        """
+        plugins = cls.get_indexed_plugins(model)
+        if plugins:
+            return plugins[0]
+
+    @classmethod
+    def get_plugin_for_label(cls, label):
+        """
+        Return the first registered plugin class for a model with the given
+        ``app_label.model_name`` label, or ``None``.
+        """
+        plugins = cls.get_indexed_plugins(label.lower())
+        if plugins:
+            return plugins[0]
+
+    @classmethod
+    def get_plugin_for_content_type(cls, content_type_id):
+        """
+        Return the first registered plugin class for a content type ID, or
+        ``None``.
+        """
+        # Content type IDs need the database, so they are indexed on first
+        # use instead of when plugins are registered.
+        cache = cls.get_plugin_cache()
+        if 'content_type_index' not in cache:
+            index = {}
+            for plugin in cls.plugins:
+                if plugin.model is not None:
+                    content_type = ContentType.objects.get_for_model(
+                        plugin.model, for_concrete_model=False)
+                    index.setdefault(content_type.pk, plugin)
+            cache['content_type_index'] = index
+        return cache['content_type_index'].get(content_type_id)
 
     @classmethod
     def unregister(cls, model):
         """
         Remove all existing plugins for a particular model
         """
-        try:
-            plugin = cls.get_plugin_for_model(model)
-            cls.plugins.remove(plugin)
-        except ValueError:
-            pass
+        for plugin in cls.get_indexed_plugins(model):
+            cls.remove_plugin(plugin)
@@ -0,0 +1,312 @@
+"""
+Delete, archive and restore users in batches with set-based queries, instead
+of loading every user, child model instance and group and permission through
+row into memory like ``QuerySet.delete()`` does.
+
+For each batch, in a transaction, rows in other tables that reference the
+users are handled according to their ``on_delete`` with Django's collector.
+Then rows are deleted from the many-to-many through tables, the child model
+tables (deepest first) and the parent table. ``pre_delete`` and
+``post_delete`` signals are not sent for the users themselves.
+"""
+
+import json
+from collections import OrderedDict
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import Q
+from django.db.models.deletion import Collector, ProtectedError
+
+from polymorphic_auth import appsettings, caching, last_login
+from polymorphic_auth.models import ArchivedUser, User, UserSearchEntry, \
+    _chunked
+
+
+def _remote_field(field):
+    # Django < 1.9 has no `remote_field`.
+    return getattr(field, 'remote_field', None) or field.rel
+
+
+def get_user_models():
+    """
+    Return every concrete model that inherits from the parent user model,
+    deepest subclasses first, followed by the parent user model.
+    """
+    models = [
+        model for model in apps.get_models()
+        if User in model._meta.get_parent_list()
+    ]
+    models.sort(key=lambda m: len(m._meta.get_parent_list()), reverse=True)
+    return models + [User]
+
+
+def get_m2m_fields(user_models):
+    """
+    Return the many-to-many fields of the user models, e.g. ``groups``.
+    """
+    return [
+        field for model in user_models
+        for field in model._meta.local_many_to_many
+    ]
+
+
+def get_related_objects(user_models, m2m_fields):
+    """
+    Return reverse relations to the user models from other models, except the
+    links from child models and the many-to-many through models.
+    """
+    excluded = set(_remote_field(f).through for f in m2m_fields)
+    related_objects = OrderedDict()
+    for model in user_models:
+        for related in model._meta.get_fields(include_hidden=True):
+            if related.auto_created and not related.concrete and \
+                    (related.one_to_many or related.one_to_one) and \
+                    not _remote_field(related.field).parent_link and \
+                    related.related_model not in excluded:
+                related_objects[related.field] = related
+    return list(related_objects.values())
+
+
+def purge_users(queryset, batch_size=1000, dry_run=False, archive=False):
+    """
+    Delete the users in ``queryset`` in batches of ``batch_size``. Returns the
+    number of rows deleted (or that would be deleted, if ``dry_run`` is true)
+    from each table, keyed by table name, including rows in other tables that
+    are deleted by ``on_delete=CASCADE``.
+
+    If ``archive`` is true, copy the users to ``ArchivedUser`` first. Rows in
+    other tables that reference the users can't be archived, so a batch that
+    would delete or update any (except search entries, which can be rebuilt)
+    raises ``ProtectedError``. Batches before it stay archived.
+    """
+    db = queryset._db or router.db_for_write(queryset.model)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    user_models = get_user_models()
+    m2m_fields = get_m2m_fields(user_models)
+    related_objects = get_related_objects(user_models, m2m_fields)
+    tables = [
+        (_remote_field(f).through._meta.db_table, f.m2m_column_name())
+        for f in m2m_fields
+    ] + [(m._meta.db_table, m._meta.pk.column) for m in user_models]
+    counts = OrderedDict()
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    batch_size = min(batch_size, connection.ops.bulk_batch_size(
+        ['pk'], range(batch_size)) or batch_size)
+    last_pk = None
+    while True:
+        batch = pks if last_pk is None else pks.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1]
+        placeholders = '(%s)' % ', '.join(['%s'] * len(batch))
+        with transaction.atomic(using=db):
+            collector = Collector(using=db)
+            for related in related_objects:
+                sub_objs = related.related_model._base_manager.using(db) \
+                    .filter(**{'%s__in' % related.field.name: batch})
+                _remote_field(related.field).on_delete(
+                    collector, related.field, sub_objs, db)
+            if archive:
+                _check_archivable(collector)
+            _count_collected(collector, counts)
+            if dry_run:
+                _count_users(batch, db, tables, counts)
+                continue
+            if archive:
+                _archive(batch, db, user_models, m2m_fields)
+            collector.delete()
+            with connection.cursor() as cursor:
+                for table, column in tables:
+                    cursor.execute(
+                        'DELETE FROM %s WHERE %s IN %s' % (
+                            qn(table), qn(column), placeholders),
+                        batch)
+                    counts[table] = counts.get(table, 0) + cursor.rowcount
+        caching.invalidate_users(batch)
+    return counts
+
+
+def archive_users(queryset, batch_size=1000, dry_run=False):
+    """
+    Copy the users in ``queryset`` to ``ArchivedUser`` and delete them. See
+    ``purge_users()``.
+    """
+    return purge_users(queryset, batch_size, dry_run, archive=True)
+
+
+def _count_collected(collector, counts):
+    """
+    Add the number of rows the collector would delete from each table.
+    """
+    for model, instances in collector.data.items():
+        table = model._meta.db_table
+        counts[table] = counts.get(table, 0) + len(instances)
+    for qs in collector.fast_deletes:
+        table = qs.model._meta.db_table
+        counts[table] = counts.get(table, 0) + qs.count()
+
+
+def _count_users(pks, db, tables, counts):
+    """
+    Add the number of rows that would be deleted from the user tables and
+    their many-to-many through tables.
+    """
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for table, column in tables:
+            cursor.execute(
+                'SELECT COUNT(*) FROM %s WHERE %s IN (%s)' % (
+                    qn(table), qn(column), ', '.join(['%s'] * len(pks))),
+                pks)
+            counts[table] = counts.get(table, 0) + cursor.fetchone()[0]
+
+
+def _check_archivable(collector):
+    """
+    Raise ``ProtectedError`` if the collector would delete or update rows
+    that ``restore_users()`` can't restore.
+    """
+    referenced = []
+    for model, instances in collector.data.items():
+        if model is not UserSearchEntry:
+            referenced.extend(instances)
+    for qs in collector.fast_deletes:
+        if qs.model is not UserSearchEntry:
+            referenced.extend(qs[:10])
+    for model, updates in collector.field_updates.items():
+        for instances in updates.values():
+            referenced.extend(instances)
+    if referenced:
+        raise ProtectedError(
+            'Cannot archive users that are referenced by rows in other '
+            'tables, which would be deleted or updated: %s. Purge the users '
+            'instead, or delete the references first.' % ', '.join(sorted(
+                set(obj._meta.db_table for obj in referenced))),
+            referenced)
+
+
+def _archive(pks, db, user_models, m2m_fields):
+    """
+    Create an ``ArchivedUser`` for each primary key, with its table rows and
+    many-to-many relations as JSON.
+    """
+    data = OrderedDict((pk, {'tables': {}, 'm2m': {}}) for pk in pks)
+    ctypes = {}
+    for model in user_models:
+        attnames = [f.attname for f in model._meta.local_concrete_fields]
+        for values in model._base_manager.using(db) \
+                .filter(pk__in=pks).values(*attnames):
+            pk = values[model._meta.pk.attname]
+            data[pk]['tables'][model._meta.db_table] = values
+            if model is User:
+                ctypes[pk] = values['polymorphic_ctype_id']
+    for field in m2m_fields:
+        through = _remote_field(field).through
+        source = through._meta.get_field(field.m2m_field_name()).attname
+        target = through._meta.get_field(
+            field.m2m_reverse_field_name()).attname
+        for pk, related_pk in through._base_manager.using(db) \
+                .filter(**{'%s__in' % source: pks}) \
+                .values_list(source, target):
+            data[pk]['m2m'].setdefault(through._meta.db_table, []) \
+                .append(related_pk)
+    ArchivedUser.objects.using(db).bulk_create([
+        ArchivedUser(
+            user_id=pk, content_type_id=ctypes[pk],
+            data=json.dumps(values, cls=DjangoJSONEncoder))
+        for pk, values in data.items() if pk in ctypes
+    ])
+
+
+def restore_users(archived_queryset, batch_size=1000):
+    """
+    Restore users from ``ArchivedUser`` rows, and delete the archived rows.
+    Returns the number of users restored. Search entries are created if the
+    ``ADMIN_SEARCH_INDEX`` setting is enabled.
+    """
+    db = archived_queryset._db or router.db_for_write(ArchivedUser)
+    connection = connections[db]
+    # Insert parent rows first.
+    user_models = list(reversed(get_user_models()))
+    models_by_table = dict((m._meta.db_table, m) for m in user_models)
+    m2m_fields = get_m2m_fields(user_models)
+    through_by_table = dict(
+        (_remote_field(f).through._meta.db_table, f) for f in m2m_fields)
+    restored = 0
+    archived = archived_queryset.order_by('pk')
+    last_pk = None
+    while True:
+        batch = archived if last_pk is None \
+            else archived.filter(pk__gt=last_pk)
+        batch = list(batch[:batch_size])
+        if not batch:
+            break
+        objs = OrderedDict((model, []) for model in user_models)
+        through_objs = OrderedDict()
+        for archived_user in batch:
+            data = json.loads(archived_user.data)
+            for table, values in data['tables'].items():
+                model = models_by_table[table]
+                obj = model()
+                for field in model._meta.local_concrete_fields:
+                    setattr(obj, field.attname,
+                            field.to_python(values[field.attname]))
+                objs[model].append(obj)
+            for table, related_pks in data['m2m'].items():
+                field = through_by_table[table]
+                through = _remote_field(field).through
+                source = through._meta.get_field(
+                    field.m2m_field_name()).attname
+                target = through._meta.get_field(
+                    field.m2m_reverse_field_name()).attname
+                through_objs.setdefault(through, []).extend(
+                    through(**{source: archived_user.user_id,
+                               target: related_pk})
+                    for related_pk in related_pks)
+        with transaction.atomic(using=db):
+            for model, model_objs in objs.items():
+                fields = model._meta.local_concrete_fields
+                size = connection.ops.bulk_batch_size(fields, model_objs)
+                for chunk in _chunked(model_objs, max(size, 1)):
+                    model._base_manager.using(db)._insert(
+                        chunk, fields=fields, using=db, raw=True)
+            for through, rows in through_objs.items():
+                through._base_manager.using(db).bulk_create(rows)
+            if appsettings.ADMIN_SEARCH_INDEX:
+                from polymorphic_auth import search
+                search.reindex_users([a.user_id for a in batch], db)
+            ArchivedUser.objects.using(db) \
+                .filter(pk__in=[a.pk for a in batch]).delete()
+        restored += len(batch)
+        last_pk = batch[-1].pk
+    return restored
+
+
+def get_users(inactive=False, last_login_before=None, ids=None):
+    """
+    Return a queryset of users that match all of the given criteria: they are
+    inactive, they have not logged in (or were created, if they have never
+    logged in) before ``last_login_before``, and they have one of the given
+    ``ids``. At least one criterion is required.
+
+    Buffered ``last_login`` timestamps are written first. Timestamps buffered
+    in the memory of other processes can't be, so use a cache for the
+    ``LAST_LOGIN_BUFFER`` setting with this.
+    """
+    q = Q()
+    if inactive:
+        q &= Q(is_active=False)
+    if last_login_before is not None:
+        last_login.flush()
+        q &= Q(last_login__lt=last_login_before) | Q(
+            last_login__isnull=True, created__lt=last_login_before)
+    if ids:
+        q &= Q(pk__in=ids)
+    if not q:
+        raise ValueError('At least one criterion is required.')
+    return User.objects.non_polymorphic().filter(q)
@@ -0,0 +1,160 @@
+"""
+Keep a denormalized, lower case copy of the searchable fields of each user in
+``UserSearchEntry``, so the admin can search users of every type with a
+single-table ``LIKE`` query instead of joining every child model table. On
+PostgreSQL, the query can use a trigram index.
+
+Entries are updated when users are saved, and by
+``UserManager.bulk_create_users()``, ``convert_type()`` and ``restore()``.
+Changes made with ``QuerySet.update()`` or raw SQL are not indexed, so run the
+``rebuild_user_search_index`` command after them.
+"""
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.utils import six
+
+from polymorphic_auth.models import User, UserSearchEntry, _chunked
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+
+SEARCH_FIELDS = ('first_name', 'last_name')
+
+
+def get_search_fields(model):
+    """
+    Return the names of fields on ``model`` to include in the search text: the
+    name fields, the username field, and the local search fields of the
+    model admin for the model's plugin.
+    """
+    fields = list(SEARCH_FIELDS) + [model.USERNAME_FIELD]
+    plugin = PolymorphicAuthChildModelPlugin.get_plugin_for_model(model)
+    model_admin = plugin and plugin.get_model_admin()
+    if model_admin is not None:
+        fields.extend(
+            field.lstrip('^=@') for field in model_admin.search_fields)
+    result = []
+    for field in fields:
+        if '__' not in field and field not in result:
+            result.append(field)
+    return result
+
+
+def get_search_text(user):
+    """
+    Return the search text for a concrete child model instance.
+    """
+    values = []
+    for name in get_search_fields(type(user)):
+        value = getattr(user, name, None)
+        if value not in (None, ''):
+            values.append(six.text_type(value))
+    return ' '.join(values).lower()
+
+
+def update_search_entry(user):
+    """
+    Create or update the search entry for a concrete child model instance.
+    """
+    text = get_search_text(user)
+    using = user._state.db or router.db_for_write(UserSearchEntry)
+    entries = UserSearchEntry.objects.using(using).filter(user_id=user.pk)
+    if entries.update(text=text):
+        return
+    try:
+        with transaction.atomic(using=using):
+            UserSearchEntry.objects.using(using).create(
+                user_id=user.pk, text=text)
+    except IntegrityError:
+        # Created concurrently.
+        entries.update(text=text)
+
+
+def update_search_entry_on_save(sender, instance, raw=False,
+                                update_fields=None, **kwargs):
+    """
+    Update the search entry for a saved user, unless only fields that are not
+    searched were saved (e.g. `last_login` on login).
+    """
+    if raw:
+        return
+    # Child model saves are sent with the child model as `sender`. Only a save
+    # of a parent model instance needs a query for the child model fields.
+    model = instance.get_real_instance_class() or sender
+    if update_fields is not None and \
+            not set(update_fields) & set(get_search_fields(model)):
+        return
+    if model._meta.concrete_model is not sender._meta.concrete_model:
+        instance = instance.get_real_instance()
+    update_search_entry(instance)
+
+
+def search(queryset, search_term):
+    """
+    Filter ``queryset`` to users with search text that contains every word in
+    ``search_term``.
+    """
+    return queryset.filter(*[
+        Q(search_entry__text__contains=bit)
+        for bit in search_term.lower().split()
+    ])
+
+
+def index_users(users, using=None):
+    """
+    Replace the search entries for concrete child model instances, with one
+    ``DELETE`` and a multi-row ``INSERT``.
+    """
+    using = using or router.db_for_write(UserSearchEntry)
+    entries = UserSearchEntry.objects.using(using)
+    with transaction.atomic(using=using):
+        entries.filter(user_id__in=[user.pk for user in users]).delete()
+        entries.bulk_create([
+            UserSearchEntry(user_id=user.pk, text=get_search_text(user))
+            for user in users
+        ])
+
+
+def reindex_users(pks, using=None, chunk_size=1000):
+    """
+    Replace the search entries for the users with primary keys ``pks``, in
+    chunks of ``chunk_size`` users.
+    """
+    for chunk in _chunked(pks, chunk_size):
+        index_users(list(
+            User.objects.using(using).filter(pk__in=chunk).order_by('pk')),
+            using)
+
+
+def rebuild_search_index(chunk_size=1000):
+    """
+    Replace the search entries for all users, in chunks of ``chunk_size``
+    users. Returns the number of users indexed.
+    """
+    users = User.objects.order_by('pk')
+    count = 0
+    last_pk = None
+    while True:
+        chunk = users if last_pk is None else users.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        index_users(chunk)
+        count += len(chunk)
+        last_pk = chunk[-1].pk
+    return count
+
+
+def connect_signals():
+    """
+    Update search entries on save of the parent model and every registered
+    child model.
+    """
+    models = [User] + [
+        plugin.model
+        for plugin in PolymorphicAuthChildModelPlugin.get_plugins()
+    ]
+    for model in models:
+        post_save.connect(
+            update_search_entry_on_save, sender=model,
+            dispatch_uid='polymorphic_auth.search.post_save.%s' % model)
@@ -0,0 +1,11 @@
+"""
+Plugin module for ``TestPluginRegistry``, imported on first use.
+"""
+
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+from polymorphic_auth.usertypes.email.models import EmailUser
+
+
+class LazyEmailUserAuthPlugin(PolymorphicAuthChildModelPlugin):
+    model = EmailUser
+    model_admin = 'polymorphic_auth.usertypes.email.admin.EmailUserAdmin'
@@ -7,10 +7,19 @@ POLYMORPHIC_AUTH = {
     'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
 }
 
+import os
+import tempfile
+
+# Files instead of `:memory:`, so tests for background threads can share the
+# test database.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': ':memory:',
+        'NAME': os.path.join(tempfile.gettempdir(), 'polymorphic_auth.sqlite3'),
+        'TEST': {
+            'NAME': os.path.join(
+                tempfile.gettempdir(), 'test_polymorphic_auth.sqlite3'),
+        },
     }
 }
 
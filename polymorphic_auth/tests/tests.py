@@ -4,12 +4,47 @@ Tests for ``polymorphic_auth`` app.
 
 # WebTest API docs: http://webtest.readthedocs.org/en/latest/api.html
 
+import json
+import logging
+import os
 import re
+import shutil
+import sys
+import tempfile
+import unittest
+from datetime import timedelta
+from timeit import default_timer
 
+from django.apps import apps as global_apps
+from django.contrib import auth
+from django.contrib.auth import HASH_SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.admin.models import ADDITION, LogEntry
 from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import RequestFactory, TestCase, TransactionTestCase, \
+    override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
 from django_webtest import WebTest
 from django.core.urlresolvers import reverse
+from django.db import connection, connections, transaction
+from django.db.models.deletion import ProtectedError
+from django.test.utils import CaptureQueriesContext
 
+from polymorphic_auth import apps, backends, caching, export, hashing, \
+    instrumentation, last_login, monkey, operations, pagination, purge, \
+    search
+from polymorphic_auth.admin import \
+    UserAdmin, create_user_creation_form, _lookup_needs_distinct
+from polymorphic_auth.models import ArchivedUser, User, UserSearchEntry
+from polymorphic_auth.plugins import PolymorphicAuthChildModelPlugin
+from polymorphic_auth.plugins.base import PluginList
+from polymorphic_auth.usertypes.email.admin import EmailUserAdmin
 from polymorphic_auth.usertypes.email.models import EmailUser
 
 
@@ -84,3 +119,1022 @@ class TestUserAdminBaseFieldsets(WebTest):
         # This will not be the case if the base_fieldsets have been lost.
 
         self.assertEqual(form1_response, form2_response)
+
+
+class TestUserChildAdminForms(TestCase):
+
+    def setUp(self):
+        self.model_admin = EmailUserAdmin(EmailUser, AdminSite())
+        self.request = RequestFactory().get('/')
+
+    def test_creation_form_is_cached(self):
+        self.assertIs(
+            create_user_creation_form(EmailUser, ('email', )),
+            create_user_creation_form(EmailUser, ['email']))
+
+    def test_get_fieldsets_does_not_change_base_fieldsets(self):
+        user = EmailUser.objects.create(email='user@test.com')
+        model_admin = self.model_admin
+        base_fieldsets = model_admin.base_fieldsets
+        fieldsets = model_admin.get_fieldsets(self.request)
+        self.assertEqual(
+            ['email', 'password1', 'password2'],
+            list(fieldsets[0][1]['fields']))
+        self.assertIs(base_fieldsets, model_admin.base_fieldsets)
+        self.assertIn(
+            base_fieldsets[1], model_admin.get_fieldsets(self.request, user))
+
+
+class TestUserAdminChangelist(TestCase):
+
+    def setUp(self):
+        self.model_admin = UserAdmin(User, AdminSite())
+        self.request = RequestFactory().get('/')
+
+    def test_lookup_needs_distinct(self):
+        opts = User._meta
+        self.assertFalse(_lookup_needs_distinct(opts, '^first_name'))
+        self.assertFalse(_lookup_needs_distinct(opts, 'emailuser__email'))
+        self.assertTrue(_lookup_needs_distinct(opts, 'groups__name'))
+        self.assertTrue(
+            _lookup_needs_distinct(opts, 'emailuser__groups__name'))
+
+    def test_annotate_username(self):
+        EmailUser.objects.create(email='user@test.com')
+        self.model_admin.annotate_username = True
+        self.assertIn(
+            'username_display', self.model_admin.get_list_display(self.request))
+        with self.assertNumQueries(1):
+            users = list(self.model_admin.get_queryset(self.request))
+            self.assertEqual(
+                'user@test.com', self.model_admin.username_display(users[0]))
+
+
+class TestKeysetPaginator(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            EmailUser.objects.create(email='user%s@test.com' % i)
+        self.queryset = User.objects.non_polymorphic().order_by('created', 'id')
+
+    def test_pages(self):
+        paginator = pagination.KeysetPaginator(self.queryset, 2)
+        self.assertEqual(5, paginator.count)
+        self.assertEqual(3, paginator.num_pages)
+        users = []
+        for number in paginator.page_range:
+            users.extend(paginator.page(number))
+        self.assertEqual(list(self.queryset), users)
+
+    def test_next_page_seeks(self):
+        paginator = pagination.KeysetPaginator(self.queryset, 2)
+        paginator.page(1)
+        expected = list(self.queryset[2:4])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(expected, list(paginator.page(2)))
+        self.assertEqual(1, len(queries))
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+
+    def test_unsupported_ordering(self):
+        paginator = pagination.KeysetPaginator(
+            self.queryset.order_by('last_login', 'id'), 2)
+        self.assertIsNone(paginator.get_keyset_ordering())
+
+
+class TestSearchIndex(TestCase):
+
+    def setUp(self):
+        self.user = EmailUser.objects.create(
+            email='Search@Test.com', first_name='Jane', last_name='Doe')
+
+    def test_rebuild_and_search(self):
+        call_command('rebuild_user_search_index', stdout=StringIO())
+        self.assertEqual(
+            'jane doe search@test.com', UserSearchEntry.objects.get().text)
+        users = search.search(User.objects.all(), 'DOE search@')
+        self.assertEqual([self.user.pk], [user.pk for user in users])
+        self.assertFalse(search.search(User.objects.all(), 'smith').exists())
+
+    def test_update_on_save(self):
+        search.update_search_entry_on_save(EmailUser, self.user)
+        self.user.last_name = 'Smith'
+        search.update_search_entry_on_save(
+            EmailUser, self.user, update_fields=['last_login'])
+        self.assertIn('doe', UserSearchEntry.objects.get().text)
+        search.update_search_entry_on_save(
+            EmailUser, self.user, update_fields=['last_name'])
+        self.assertIn('smith', UserSearchEntry.objects.get().text)
+
+    def test_update_on_save_of_parent_model(self):
+        parent = User.objects.non_polymorphic().get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            search.update_search_entry_on_save(
+                User, parent, update_fields=['last_login'])
+        parent.last_name = 'Smith'
+        parent.save()
+        search.update_search_entry_on_save(User, parent)
+        self.assertEqual(
+            'jane smith search@test.com', UserSearchEntry.objects.get().text)
+
+    def test_bulk_paths_update_index(self):
+        index_settings = self.settings(POLYMORPHIC_AUTH={
+            'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+            'ADMIN_SEARCH_INDEX': True})
+        with index_settings:
+            EmailUser.objects.bulk_create_users([
+                {'email': 'Bulk@Test.com', 'first_name': 'Bulk'}])
+            bulk = EmailUser.objects.get(email='Bulk@Test.com')
+            self.assertEqual(
+                'bulk bulk@test.com',
+                UserSearchEntry.objects.get(user_id=bulk.pk).text)
+
+            User.objects.convert_type(
+                EmailUser.objects.filter(pk=bulk.pk), User)
+            self.assertEqual(
+                'bulk %s' % bulk.pk,
+                UserSearchEntry.objects.get(user_id=bulk.pk).text)
+
+            User.objects.archive(User.objects.filter(pk=bulk.pk))
+            self.assertFalse(
+                UserSearchEntry.objects.filter(user_id=bulk.pk).exists())
+            User.objects.restore(ArchivedUser.objects.all())
+            self.assertEqual(
+                'bulk %s' % bulk.pk,
+                UserSearchEntry.objects.get(user_id=bulk.pk).text)
+
+    def test_admin_search(self):
+        search.update_search_entry(self.user)
+        model_admin = UserAdmin(User, AdminSite())
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'ADMIN_SEARCH_INDEX': True}):
+            queryset, use_distinct = model_admin.get_search_results(
+                RequestFactory().get('/'), User.objects.all(), 'jane')
+        self.assertEqual([self.user.pk], [user.pk for user in queryset])
+        self.assertFalse(use_distinct)
+
+
+class TestImportUsers(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'users.csv')
+        with open(self.path, 'w') as f:
+            f.write(
+                'type,email,name,is_staff\n'
+                'polymorphic_auth_email.emailuser,one@test.com,One Test,True\n'
+                ',two@test.com,Two Test,\n'
+                ',three@test.com,Three Test,False\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_import_users(self):
+        credentials = os.path.join(self.tmpdir, 'credentials.txt')
+        call_command(
+            'import_users', self.path, chunk_size=2, credentials=credentials,
+            stdout=StringIO())
+        one = EmailUser.objects.get(email='one@test.com')
+        self.assertEqual(('One', 'Test'), (one.first_name, one.last_name))
+        self.assertTrue(one.is_staff)
+        self.assertFalse(EmailUser.objects.get(email='three@test.com').is_staff)
+        with open(credentials) as f:
+            self.assertEqual(3, f.read().count('Created user account:'))
+
+    def test_import_users_resumes_from_checkpoint(self):
+        checkpoint = os.path.join(self.tmpdir, 'checkpoint')
+        with open(checkpoint, 'w') as f:
+            f.write('2')
+        call_command(
+            'import_users', self.path, checkpoint=checkpoint, stdout=StringIO())
+        self.assertEqual(
+            ['three@test.com'],
+            list(EmailUser.objects.values_list('email', flat=True)))
+        with open(checkpoint) as f:
+            self.assertEqual('3', f.read())
+
+    def test_import_users_reports_row_of_clashing_user(self):
+        with open(self.path, 'a') as f:
+            f.write(',TWO@test.com,Two Test,\n')
+        with self.assertRaises(CommandError) as cm:
+            call_command(
+                'import_users', self.path, chunk_size=2, stdout=StringIO())
+        self.assertTrue(str(cm.exception).startswith('Row 4: '))
+        # Only the first chunk was imported.
+        self.assertEqual(2, EmailUser.objects.count())
+
+
+class TestExportUsers(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            EmailUser.objects.create(
+                email='user%d@test.com' % i, first_name='User%d' % i)
+        ContentType.objects.clear_cache()
+        ContentType.objects.get_for_model(EmailUser)
+
+    def test_iter_user_rows(self):
+        # Three chunks and a final empty chunk, plus one query per user type
+        # in each chunk.
+        with self.assertNumQueries(7):
+            rows = list(export.iter_user_rows(
+                columns=['type', 'email', 'first_name'], chunk_size=2))
+        self.assertEqual(5, len(rows))
+        self.assertEqual({
+            'type': 'polymorphic_auth_email.emailuser',
+            'email': 'user0@test.com',
+            'first_name': 'User0',
+        }, rows[0])
+
+    def test_default_columns_exclude_password(self):
+        columns = export.get_export_columns()
+        self.assertTrue('email' in columns)
+        self.assertFalse('password' in columns)
+
+    def test_export_users_jsonl(self):
+        out = StringIO()
+        call_command(
+            'export_users', format='jsonl', columns='email,is_active',
+            stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(5, len(rows))
+        self.assertEqual(
+            {'email': 'user4@test.com', 'is_active': True}, rows[-1])
+
+
+class TestPluginRegistry(TestCase):
+
+    def tearDown(self):
+        PolymorphicAuthChildModelPlugin.clear_plugin_cache()
+
+    def test_plugin_instances_are_cached(self):
+        plugins = PolymorphicAuthChildModelPlugin.get_plugins()
+        self.assertEqual(1, len(plugins))
+        self.assertTrue(
+            plugins[0] is PolymorphicAuthChildModelPlugin.get_plugins()[0])
+        self.assertTrue(
+            plugins[0] is
+            PolymorphicAuthChildModelPlugin.get_plugins_by_model()[EmailUser])
+        ctype = ContentType.objects.get_for_model(EmailUser)
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                plugins[0] is PolymorphicAuthChildModelPlugin
+                .get_plugins_by_content_type()[ctype.pk])
+
+    def test_clear_plugin_cache(self):
+        plugins = PolymorphicAuthChildModelPlugin.get_plugins()
+        PolymorphicAuthChildModelPlugin.clear_plugin_cache()
+        self.assertFalse(
+            plugins[0] is PolymorphicAuthChildModelPlugin.get_plugins()[0])
+
+    def test_plugin_index(self):
+        plugin = PolymorphicAuthChildModelPlugin.get_plugin_for_model(EmailUser)
+        self.assertEqual(EmailUser, plugin.model)
+        self.assertTrue(plugin is PolymorphicAuthChildModelPlugin
+                        .get_plugin_for_label('polymorphic_auth_email.EmailUser'))
+        ctype = ContentType.objects.get_for_model(EmailUser)
+        self.assertTrue(plugin is PolymorphicAuthChildModelPlugin
+                        .get_plugin_for_content_type(ctype.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(plugin is PolymorphicAuthChildModelPlugin
+                            .get_plugin_for_content_type(ctype.pk))
+            self.assertIsNone(PolymorphicAuthChildModelPlugin
+                              .get_plugin_for_content_type(0))
+
+    def test_unregister_unknown_model(self):
+        plugins = list(PolymorphicAuthChildModelPlugin.plugins)
+        PolymorphicAuthChildModelPlugin.unregister(ContentType)
+        self.assertEqual(plugins, PolymorphicAuthChildModelPlugin.plugins)
+
+    def test_unregister(self):
+        plugin = PolymorphicAuthChildModelPlugin.get_plugin_for_model(EmailUser)
+        PolymorphicAuthChildModelPlugin.unregister(EmailUser)
+        try:
+            self.assertEqual([], PolymorphicAuthChildModelPlugin.plugins)
+            self.assertEqual([], PolymorphicAuthChildModelPlugin.get_plugins())
+            self.assertIsNone(PolymorphicAuthChildModelPlugin
+                              .get_plugin_for_model(EmailUser))
+        finally:
+            PolymorphicAuthChildModelPlugin.register_plugin(plugin)
+        self.assertEqual([plugin], PolymorphicAuthChildModelPlugin.plugins)
+
+    def test_plugins_list(self):
+        plugin = PolymorphicAuthChildModelPlugin.get_plugin_for_model(EmailUser)
+        plugins = PolymorphicAuthChildModelPlugin.plugins
+        self.assertIs(plugins, plugin().plugins)
+        # Changes to the list are seen by the cached instances and indexes.
+        plugins.remove(plugin)
+        try:
+            self.assertEqual([], PolymorphicAuthChildModelPlugin.get_plugins())
+            self.assertIsNone(PolymorphicAuthChildModelPlugin
+                              .get_plugin_for_model(EmailUser))
+        finally:
+            plugins.append(plugin)
+        self.assertIs(plugin, PolymorphicAuthChildModelPlugin
+                      .get_plugins_by_model()[EmailUser].__class__)
+
+    def test_plugin_list(self):
+        plugin = PolymorphicAuthChildModelPlugin.get_plugin_for_model(EmailUser)
+        plugins = PluginList([plugin])
+        version = plugins.version
+        self.assertEqual([plugin], plugins.get_indexed(EmailUser))
+        self.assertEqual(
+            [plugin], plugins.get_indexed('polymorphic_auth_email.emailuser'))
+        plugins.remove(plugin)
+        self.assertNotEqual(version, plugins.version)
+        self.assertEqual([], plugins)
+        self.assertEqual([], plugins.get_indexed(EmailUser))
+        with self.assertRaises(ValueError):
+            plugins.remove(plugin)
+
+    def test_lazy_plugin_modules(self):
+        module = 'polymorphic_auth.tests.lazy_plugins'
+        PolymorphicAuthChildModelPlugin.add_plugin_modules(module)
+        self.assertNotIn(module, sys.modules)
+        PolymorphicAuthChildModelPlugin.get_plugins()
+        plugins = PolymorphicAuthChildModelPlugin.plugins
+        self.addCleanup(
+            PolymorphicAuthChildModelPlugin.remove_plugin, plugins[-1])
+        self.assertIn(module, sys.modules)
+        self.assertEqual(2, len(plugins))
+        self.assertIs(EmailUserAdmin, plugins[-1].get_model_admin())
+
+
+class TestGetUserModel(TestCase):
+
+    def test_user_model_is_cached(self):
+        monkey.clear_user_model_cache()
+        self.assertTrue(auth.get_user_model() is EmailUser)
+        self.assertTrue(monkey._user_model_cache['model'] is EmailUser)
+
+    def test_setting_changed(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth.User'}):
+            self.assertTrue(auth.get_user_model() is User)
+        self.assertTrue(auth.get_user_model() is EmailUser)
+
+
+class TestPolymorphicModelBackend(TestCase):
+
+    def setUp(self):
+        self.user = EmailUser.objects.create(email='user@test.com')
+        self.backend = backends.PolymorphicModelBackend()
+        ContentType.objects.get_for_model(EmailUser)
+
+    def test_get_user(self):
+        with self.assertNumQueries(1):
+            user = self.backend.get_user(self.user.pk)
+            self.assertTrue(isinstance(user, EmailUser))
+            self.assertEqual('user@test.com', user.email)
+
+    def test_get_user_with_session_hint(self):
+        request = RequestFactory().get('/')
+        request.session = {
+            backends.CONTENT_TYPE_SESSION_KEY: self.user.polymorphic_ctype_id,
+        }
+        with backends.session_hints(request):
+            with self.assertNumQueries(1):
+                user = self.backend.get_user(self.user.pk)
+        self.assertEqual(self.user, user)
+        self.assertTrue(isinstance(user, EmailUser))
+
+    def test_get_user_does_not_exist(self):
+        self.assertIsNone(self.backend.get_user(self.user.pk + 1))
+
+    def test_authenticate_email_user(self):
+        self.user.set_password('password')
+        self.user.save()
+        backend = 'polymorphic_auth.backends.PolymorphicModelBackend'
+        with self.settings(AUTHENTICATION_BACKENDS=[backend]):
+            user = auth.authenticate(
+                username='user@test.com', password='password')
+        self.assertEqual(self.user, user)
+        self.assertTrue(isinstance(user, EmailUser))
+
+
+class TestUserCache(TestCase):
+
+    def setUp(self):
+        self.user = EmailUser.objects.create(email='user@test.com')
+        self.backend = backends.PolymorphicModelBackend()
+        ContentType.objects.get_for_model(EmailUser)
+        caching.connect_signals()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_get_user_from_cache(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'USER_CACHE': 'default'}):
+            with self.assertNumQueries(1):
+                self.backend.get_user(self.user.pk)
+            with self.assertNumQueries(0):
+                user = self.backend.get_user(self.user.pk)
+            self.assertTrue(isinstance(user, EmailUser))
+            self.assertEqual(self.user.email, user.email)
+            self.assertEqual(self.user.created, user.created)
+
+            # Saving the user invalidates the cache.
+            self.user.is_active = False
+            self.user.save()
+            with self.assertNumQueries(1):
+                self.assertIsNone(self.backend.get_user(self.user.pk))
+
+    def test_password_change_misses_cache(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'USER_CACHE': 'default'}):
+            self.backend.get_user(self.user.pk)
+            request = RequestFactory().get('/')
+            request.session = {auth.HASH_SESSION_KEY: 'stale'}
+            with backends.session_hints(request):
+                with self.assertNumQueries(1):
+                    self.backend.get_user(self.user.pk)
+
+
+@override_settings(AUTHENTICATION_BACKENDS=(
+    'polymorphic_auth.backends.PolymorphicModelBackend',
+))
+class TestPermissionCache(TestCase):
+
+    def setUp(self):
+        self.user = EmailUser.objects.create(email='user@test.com')
+        self.group = Group.objects.create(name='Group')
+        self.group.permissions.add(
+            Permission.objects.get(codename='change_group'))
+        self.user.groups.add(self.group)
+        self.user.user_permissions.add(
+            Permission.objects.get(codename='add_group'))
+        self.backend = backends.PolymorphicModelBackend()
+        caching.connect_signals()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def reload(self):
+        return EmailUser.objects.get(pk=self.user.pk)
+
+    def test_get_all_permissions(self):
+        user = self.reload()
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                set(['auth.add_group', 'auth.change_group']),
+                self.backend.get_all_permissions(user))
+            self.assertTrue(user.has_perm('auth.change_group'))
+
+    def test_permission_cache(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'PERMISSION_CACHE': 'default'}):
+            self.backend.get_all_permissions(self.reload())
+            user = self.reload()
+            with self.assertNumQueries(0):
+                self.assertTrue(user.has_perm('auth.change_group'))
+
+            # Changing group permissions invalidates the cache.
+            self.group.permissions.clear()
+            self.assertEqual(
+                set(['auth.add_group']),
+                self.backend.get_all_permissions(self.reload()))
+
+    def test_warm_permissions(self):
+        other = EmailUser.objects.create(email='other@test.com')
+        users = [self.reload(), other]
+        with self.assertNumQueries(2):
+            caching.warm_permissions(users)
+        with self.assertNumQueries(0):
+            self.assertTrue(users[0].has_perm('auth.add_group'))
+            self.assertFalse(users[1].has_perm('auth.add_group'))
+
+
+@override_settings(
+    ADMINS=(('Admin Test', 'admin@test.com'), ),
+    MANAGERS=(('Admin Test', 'Admin@test.com'),
+              ('Manager Test', 'manager@test.com')),
+)
+class TestCreateUsers(TestCase):
+
+    def test_create_users(self):
+        EmailUser.objects.create(email='manager@test.com')
+        apps.create_users(sender=None)
+        self.assertEqual(
+            ['admin@test.com', 'manager@test.com'],
+            sorted(EmailUser.objects.values_list('email', flat=True)))
+        admin = EmailUser.objects.get(email='admin@test.com')
+        self.assertTrue(admin.is_superuser)
+        self.assertEqual('Admin', admin.first_name)
+
+    def test_create_users_disabled(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'CREATE_USERS_ON_MIGRATE': False}):
+            apps.create_users(sender=None)
+        self.assertFalse(EmailUser.objects.exists())
+
+
+class TestTryCreate(TestCase):
+
+    def test_existing_user_is_not_hashed(self):
+        user = EmailUser.objects.create(email='existing@test.com')
+        stdout = StringIO()
+        with self.assertNumQueries(1):
+            result, created = EmailUser.try_create(
+                email='existing@test.com', _stdout=stdout)
+        self.assertEqual(user, result)
+        self.assertFalse(created)
+        self.assertEqual('', stdout.getvalue())
+
+    def test_unusable_password(self):
+        stdout = StringIO()
+        user, created = EmailUser.try_create(
+            email='new@test.com', _unusable_password=True, _stdout=stdout)
+        self.assertTrue(created)
+        self.assertFalse(user.has_usable_password())
+        self.assertIn('password: (unusable)', stdout.getvalue())
+
+    def test_given_password(self):
+        user, created = EmailUser.try_create(
+            email='new@test.com', password='secret', _stdout=StringIO())
+        self.assertTrue(user.check_password('secret'))
+
+    @unittest.skipIf(
+        hasattr(transaction, 'on_commit'), 'Django >= 1.9 has on_commit().')
+    def test_defer_hashing_in_transaction(self):
+        user, created = EmailUser.try_create(
+            email='new@test.com', password='secret', _defer_hashing=True,
+            _stdout=StringIO())
+        self.assertFalse(user.has_usable_password())
+        # Without `on_commit()` the password is saved before `try_create()`
+        # returns, inside the test transaction.
+        self.assertTrue(
+            User.objects.get(pk=user.pk).check_password('secret'))
+
+    def test_set_password_for_missing_user(self):
+        with self.assertRaises(User.DoesNotExist):
+            hashing._set_password(User, 0, 'secret', 'default')
+
+
+class TestDeferredHashing(TransactionTestCase):
+
+    def test_defer_hashing(self):
+        user, created = EmailUser.try_create(
+            email='new@test.com', password='secret', _defer_hashing=True,
+            _stdout=StringIO())
+        self.assertFalse(user.has_usable_password())
+        hashing.wait_for_deferred_passwords()
+        self.assertTrue(
+            User.objects.get(pk=user.pk).check_password('secret'))
+
+    def test_defer_set_password(self):
+        user = EmailUser.objects.create(email='user@test.com')
+        hashing.defer_set_password(user, 'secret')
+        hashing.wait_for_deferred_passwords()
+        self.assertTrue(
+            User.objects.get(pk=user.pk).check_password('secret'))
+
+    def test_deferred_error_is_logged(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('polymorphic_auth.hashing')
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        user = EmailUser.objects.create(email='user@test.com')
+        User.objects.filter(pk=user.pk).delete()
+        hashing.defer_set_password(user, 'secret')
+        hashing.wait_for_deferred_passwords()
+        self.assertEqual(['ERROR'], [r.levelname for r in records])
+        self.assertEqual(0, hashing._deferred['pending'])
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'Requires Python 3.5+.')
+class TestAsyncio(TransactionTestCase):
+
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.user = EmailUser.objects.create_user(
+            email='user@test.com', password='secret')
+
+    def test_get_by_natural_key(self):
+        user = self.loop.run_until_complete(
+            EmailUser.objects.aget_by_natural_key('USER@test.com'))
+        self.assertEqual(self.user, user)
+        self.assertTrue(isinstance(user, EmailUser))
+
+    def test_create_user(self):
+        user = self.loop.run_until_complete(
+            EmailUser.objects.acreate_user(
+                email='new@test.com', password='secret'))
+        self.assertFalse(user.is_staff)
+        self.assertTrue(
+            User.objects.get(pk=user.pk).check_password('secret'))
+
+    def test_try_create(self):
+        user, created = self.loop.run_until_complete(
+            EmailUser.atry_create(email='user@test.com', _stdout=StringIO()))
+        self.assertEqual(self.user, user)
+        self.assertFalse(created)
+        user, created = self.loop.run_until_complete(
+            EmailUser.atry_create(
+                email='new@test.com', password='secret', _stdout=StringIO()))
+        self.assertTrue(created)
+        self.assertTrue(
+            User.objects.get(pk=user.pk).check_password('secret'))
+
+    def test_check_password(self):
+        self.assertTrue(self.loop.run_until_complete(
+            self.user.acheck_password('secret')))
+        self.assertFalse(self.loop.run_until_complete(
+            self.user.acheck_password('wrong')))
+
+    def test_db_executor_closes_connections(self):
+        from polymorphic_auth import aio
+
+        def query():
+            EmailUser.objects.count()
+            return connections['default']
+
+        worker_connection = self.loop.run_until_complete(
+            aio.run_in_executor('db', query))
+        self.assertIsNot(connections['default'], worker_connection)
+        self.assertIsNone(worker_connection.connection)
+
+
+class TestInstrumentation(TestCase):
+
+    def test_operation_completed(self):
+        reports = []
+
+        def receiver(operation, duration, queries, **kwargs):
+            reports.append((operation, queries))
+
+        instrumentation.operation_completed.connect(receiver)
+        self.addCleanup(
+            instrumentation.operation_completed.disconnect, receiver)
+        EmailUser.objects.create(email='user@test.com')
+        del reports[:]
+        EmailUser.objects.get_by_natural_key('USER@test.com')
+        self.assertEqual([('get_by_natural_key', 1)], reports)
+
+        # Queries are counted when the query log is full.
+        del reports[:]
+        with CaptureQueriesContext(connection):
+            connection.queries_log.extend([{}] * connection.queries_limit)
+            try:
+                EmailUser.objects.get_by_natural_key('USER@test.com')
+            finally:
+                connection.queries_log.clear()
+        self.assertEqual([('get_by_natural_key', 1)], reports)
+
+    def test_metrics_callback(self):
+        calls = []
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'METRICS_CALLBACK': lambda *args: calls.append(args)}):
+            with instrumentation.instrument('test'):
+                pass
+        self.assertEqual(1, len(calls))
+        self.assertEqual('test', calls[0][0])
+
+
+class TestLastLoginBuffer(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        last_login._memory_buffer.pop()
+        self.cancel_flush_timer()
+        self.addCleanup(self.cancel_flush_timer)
+        self.users = [
+            EmailUser.objects.create(email='user%s@test.com' % i)
+            for i in range(3)
+        ]
+
+    def cancel_flush_timer(self):
+        timer = last_login._flush_thread['timer']
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+
+    def assertBuffered(self, buffer):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'LAST_LOGIN_BUFFER': buffer,
+                'LAST_LOGIN_FLUSH_INTERVAL': 3600,
+                'LAST_LOGIN_FLUSH_LIMIT': 3}):
+            with self.assertNumQueries(0):
+                for user in self.users[:2]:
+                    last_login.buffer_last_login(None, user)
+            self.assertFalse(
+                User.objects.filter(last_login__isnull=False).exists())
+            # Reaching the limit flushes all users in a background thread,
+            # not in the login request.
+            with self.assertNumQueries(0):
+                last_login.buffer_last_login(None, self.users[2])
+            last_login.wait_for_flush()
+        for user in self.users:
+            self.assertEqual(
+                user.last_login, User.objects.get(pk=user.pk).last_login)
+
+    def test_memory_buffer(self):
+        self.assertBuffered('memory')
+
+    def test_cache_buffer(self):
+        cache.set(last_login.FLUSH_TIMER_KEY, 1)
+        self.assertBuffered('default')
+
+    def test_cache_buffer_waits_for_unwritten_slots(self):
+        buffer = last_login.CacheBuffer('default')
+        now = timezone.now()
+        buffer.add(1, now)
+        # A slot that has been numbered but not written yet.
+        cache.incr(last_login.COUNTER_KEY)
+        buffer.add(3, now)
+        self.assertEqual({1: now}, buffer.pop())
+        cache.set(last_login.SLOT_KEY % 2, (2, now))
+        self.assertEqual({2: now, 3: now}, buffer.pop())
+        self.assertEqual({}, buffer.pop())
+
+    def test_cache_buffer_skips_lost_slots(self):
+        buffer = last_login.CacheBuffer('default')
+        now = timezone.now()
+        cache.add(last_login.COUNTER_KEY, 0)
+        cache.incr(last_login.COUNTER_KEY)
+        buffer.add(2, now)
+        self.assertEqual({}, buffer.pop())
+        self.assertEqual({2: now}, buffer.pop())
+
+    def test_flush_invalidates_cached_users(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'LAST_LOGIN_BUFFER': 'memory',
+                'LAST_LOGIN_FLUSH_INTERVAL': 3600,
+                'USER_CACHE': 'default'}):
+            caching.cache_user(self.users[0])
+            last_login.buffer_last_login(None, self.users[0])
+            last_login.flush()
+            self.assertIsNone(caching.get_cached_user(self.users[0].pk))
+
+    def test_flush_last_login(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'LAST_LOGIN_BUFFER': 'default',
+                'LAST_LOGIN_FLUSH_INTERVAL': 3600}):
+            cache.set(last_login.FLUSH_TIMER_KEY, 1)
+            last_login.buffer_last_login(None, self.users[0])
+            stdout = StringIO()
+            call_command('flush_last_login', stdout=stdout)
+        self.assertIn('1 users', stdout.getvalue())
+        self.assertIsNotNone(
+            User.objects.get(pk=self.users[0].pk).last_login)
+
+    def test_flush_last_login_from_memory(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'LAST_LOGIN_BUFFER': 'memory'}):
+            with self.assertRaises(CommandError):
+                call_command('flush_last_login', stdout=StringIO())
+
+    def test_flush_on_timer(self):
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'LAST_LOGIN_BUFFER': 'memory',
+                'LAST_LOGIN_FLUSH_INTERVAL': 0.1}):
+            last_login._memory_buffer.last_flush = default_timer()
+            last_login.buffer_last_login(None, self.users[0])
+            self.assertIsNone(
+                User.objects.get(pk=self.users[0].pk).last_login)
+            # No other login happens.
+            last_login._flush_thread['timer'].join()
+            last_login.wait_for_flush()
+        self.assertIsNotNone(
+            User.objects.get(pk=self.users[0].pk).last_login)
+
+
+class TestPasswordUpgrade(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = EmailUser.objects.create(
+            email='user@test.com',
+            password=make_password('secret', hasher='md5'))
+
+    def test_queue_password_upgrade(self):
+        queued = []
+        self.addCleanup(
+            setattr, hashing, 'queue_password_upgrade',
+            hashing.queue_password_upgrade)
+        hashing.queue_password_upgrade = \
+            lambda user, raw_password: queued.append(raw_password)
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'PASSWORD_UPGRADE': 'queue'}):
+            with self.assertNumQueries(0):
+                self.assertTrue(self.user.check_password('secret'))
+        self.assertEqual(['secret'], queued)
+        self.assertTrue(self.user.password.startswith('md5$'))
+
+    def test_upgrade_password(self):
+        session = {HASH_SESSION_KEY: self.user.get_session_auth_hash()}
+        hashing._upgrade_password(
+            User, self.user.pk, self.user.password, 'secret', 'default')
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.password.startswith('pbkdf2_'))
+        self.assertTrue(user.check_password('secret'))
+        hashing.update_session_auth_hash(session)
+        self.assertEqual(
+            user.get_session_auth_hash(), session[HASH_SESSION_KEY])
+
+    def test_password_hash_report(self):
+        EmailUser.objects.create(
+            email='current@test.com', password=make_password('secret'))
+        EmailUser.objects.create(
+            email='unusable@test.com', password=make_password(None))
+        stdout = StringIO()
+        call_command('password_hash_report', stdout=stdout)
+        lines = dict(
+            line.rsplit(None, 1) for line in stdout.getvalue().splitlines())
+        self.assertEqual('1', lines['md5'])
+        self.assertEqual('1', lines['unusable'])
+        self.assertEqual('1', lines['outdated'])
+
+
+class TestBackfillNormalizedUsername(TestCase):
+
+    def test_backfill_existing_rows(self):
+        emile = EmailUser.objects.create(email=u'\xc9mile@Test.com')
+        for i in range(2):
+            EmailUser.objects.create(email='User%d@Test.com' % i)
+        EmailUser.objects.update(email_normalized=None)
+        operation = operations.BackfillNormalizedUsername(
+            model_name='emailuser', field='email',
+            normalized_field='email_normalized', batch_size=2)
+        operation.app_label = 'polymorphic_auth_email'
+        operation.backfill(global_apps, connection.schema_editor())
+        self.assertEqual(
+            [u'\xe9mile@test.com', 'user0@test.com', 'user1@test.com'],
+            list(EmailUser.objects.order_by('pk')
+                 .values_list('email_normalized', flat=True)))
+        self.assertEqual(
+            emile, EmailUser.objects.get_by_natural_key(u'\xe9mile@test.com'))
+
+
+class TestConvertType(TestCase):
+
+    def test_convert_type(self):
+        group = Group.objects.create(name='Group')
+        user = EmailUser.objects.create(email='User@Test.com')
+        user.groups.add(group)
+
+        self.assertEqual(1, User.objects.convert_type(
+            EmailUser.objects.all(), User))
+        converted = User.objects.get(pk=user.pk)
+        self.assertIs(User, type(converted))
+        self.assertFalse(EmailUser.objects.exists())
+        self.assertEqual([group], list(converted.groups.all()))
+
+        User.objects.filter(pk=user.pk).update(last_name='User@Test.com')
+        self.assertEqual(1, User.objects.convert_type(
+            User.objects.all(), EmailUser, field_map={'email': 'last_name'}))
+        converted = User.objects.get(pk=user.pk)
+        self.assertIs(EmailUser, type(converted))
+        self.assertEqual('User@Test.com', converted.email)
+        self.assertEqual('user@test.com', converted.email_normalized)
+        self.assertEqual([group], list(converted.groups.all()))
+
+    def test_convert_type_normalizes_non_ascii_username(self):
+        user = User.objects.create(last_name=u'\xc9mile@Test.com')
+        User.objects.convert_type(
+            User.objects.all(), EmailUser, field_map={'email': 'last_name'})
+        self.assertEqual(
+            user.pk,
+            EmailUser.objects.get_by_natural_key(u'\xe9mile@test.com').pk)
+
+    def test_convert_type_to_same_model(self):
+        with self.assertRaises(ValueError):
+            User.objects.convert_type(EmailUser.objects.all(), EmailUser)
+
+    def test_convert_type_in_batches(self):
+        pks = [
+            EmailUser.objects.create(email='User%d@Test.com' % i).pk
+            for i in range(3)
+        ]
+        self.assertEqual(3, User.objects.convert_type(
+            EmailUser.objects.all(), User, batch_size=2))
+        for i, pk in enumerate(pks):
+            User.objects.filter(pk=pk).update(first_name='User%d@Test.com' % i)
+        # Allow two parameters per query. The default value of
+        # `email_normalized` takes one, leaving room for one user per batch.
+        ops = connection.ops
+        ops.bulk_batch_size = lambda fields, objs: 2
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(3, User.objects.convert_type(
+                    User.objects.filter(pk__in=pks), EmailUser,
+                    field_map={'email': 'first_name'}, batch_size=2))
+        finally:
+            del ops.bulk_batch_size
+        inserts = [
+            query for query in queries
+            if 'INSERT INTO' in query['sql']]
+        self.assertEqual(3, len(inserts))
+        self.assertEqual(
+            ['user0@test.com', 'user1@test.com', 'user2@test.com'],
+            list(EmailUser.objects.order_by('pk')
+                 .values_list('email_normalized', flat=True)))
+
+    def test_convert_type_with_invalid_field_map(self):
+        with self.assertRaises(ValueError):
+            User.objects.convert_type(
+                User.objects.all(), EmailUser, field_map={'mail': 'email'})
+        with self.assertRaises(ValueError):
+            User.objects.convert_type(
+                User.objects.all(), EmailUser,
+                field_map={'email': 'last_nme'})
+        with self.assertRaises(ValueError):
+            # Parent model fields are kept, not inserted.
+            User.objects.convert_type(
+                User.objects.all(), EmailUser,
+                field_map={'first_name': 'last_name'})
+
+
+class TestPurgeUsers(TestCase):
+
+    def setUp(self):
+        self.group = Group.objects.create(name='Group')
+        self.inactive = EmailUser.objects.create(
+            email='inactive@test.com', is_active=False)
+        self.inactive.groups.add(self.group)
+        self.active = EmailUser.objects.create(email='active@test.com')
+
+    def test_purge(self):
+        counts = User.objects.purge(
+            User.objects.filter(is_active=False), batch_size=1)
+        self.assertEqual(1, counts[EmailUser._meta.db_table])
+        self.assertEqual(1, counts[User._meta.db_table])
+        self.assertEqual(
+            [self.active.pk], list(User.objects.values_list('pk', flat=True)))
+        self.assertEqual(
+            [self.active.pk],
+            list(EmailUser.objects.values_list('pk', flat=True)))
+        self.assertFalse(self.group.user_set.exists())
+        self.assertTrue(Group.objects.filter(pk=self.group.pk).exists())
+
+    def test_dry_run(self):
+        stdout = StringIO()
+        call_command('purge_users', inactive=True, dry_run=True, stdout=stdout)
+        self.assertIn(
+            'Would delete 1 rows from %s.' % User._meta.db_table,
+            stdout.getvalue())
+        self.assertEqual(2, User.objects.count())
+
+    def test_archive_and_restore(self):
+        call_command('archive_users', inactive=True, stdout=StringIO())
+        self.assertFalse(User.objects.filter(pk=self.inactive.pk).exists())
+        archived = ArchivedUser.objects.get()
+        self.assertEqual(self.inactive.pk, archived.user_id)
+
+        call_command('archive_users', restore=True, stdout=StringIO())
+        self.assertFalse(ArchivedUser.objects.exists())
+        restored = User.objects.get(pk=self.inactive.pk)
+        self.assertIs(EmailUser, type(restored))
+        self.assertEqual('inactive@test.com', restored.email)
+        self.assertFalse(restored.is_active)
+        self.assertEqual([self.group], list(restored.groups.all()))
+
+    def create_log_entry(self):
+        return LogEntry.objects.log_action(
+            self.inactive.pk, ContentType.objects.get_for_model(Group).pk,
+            self.group.pk, 'Group', ADDITION)
+
+    def test_dry_run_counts_cascades(self):
+        self.create_log_entry()
+        counts = User.objects.purge(
+            User.objects.filter(is_active=False), dry_run=True)
+        self.assertEqual(1, counts[LogEntry._meta.db_table])
+        self.assertEqual(1, LogEntry.objects.count())
+
+    def test_archive_referenced_users(self):
+        self.create_log_entry()
+        with self.assertRaises(ProtectedError):
+            User.objects.archive(User.objects.filter(is_active=False))
+        self.assertTrue(User.objects.filter(pk=self.inactive.pk).exists())
+        self.assertFalse(ArchivedUser.objects.exists())
+
+    def test_last_login_before_flushes_buffer(self):
+        now = timezone.now()
+        User.objects.filter(pk=self.inactive.pk).update(
+            last_login=now - timedelta(days=30))
+        with self.settings(POLYMORPHIC_AUTH={
+                'DEFAULT_CHILD_MODEL': 'polymorphic_auth_email.EmailUser',
+                'LAST_LOGIN_BUFFER': 'memory',
+                'LAST_LOGIN_FLUSH_INTERVAL': 3600}):
+            last_login.buffer_last_login(None, self.inactive)
+            users = purge.get_users(
+                inactive=True, last_login_before=now - timedelta(days=1))
+            self.assertFalse(users.exists())
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import polymorphic_auth.operations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polymorphic_auth_email', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailuser',
+            name='email_normalized',
+            field=models.EmailField(max_length=254, unique=True, null=True, verbose_name='normalized email address', editable=False),
+        ),
+        polymorphic_auth.operations.BackfillNormalizedUsername(
+            model_name='emailuser',
+            field='email',
+            normalized_field='email_normalized',
+        ),
+    ]
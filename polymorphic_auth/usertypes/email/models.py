@@ -1,3 +1,4 @@
+from django.db import models
 from django.utils.translation import ugettext_lazy as _
 from polymorphic_auth.models import EmailFieldMixin, User, UserManager
 
@@ -7,10 +8,18 @@ class AbstractEmailUser(User, EmailFieldMixin):
     Abstract polymorphic child model with email login.
     """
 
+    # Lowercase copy of `email`, so case-insensitive lookups can use an index.
+    # Nullable so existing rows can be backfilled after the column is added.
+    # See: `polymorphic_auth.operations.BackfillNormalizedUsername`
+    email_normalized = models.EmailField(
+        _('normalized email address'), max_length=254, unique=True, null=True,
+        editable=False)
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name']
 
     IS_USERNAME_CASE_INSENSITIVE = True
+    NORMALIZED_USERNAME_FIELD = 'email_normalized'
 
     class Meta:
         abstract = True
@@ -21,6 +30,13 @@ class AbstractEmailUser(User, EmailFieldMixin):
     def username(self):
         return getattr(self, self.USERNAME_FIELD)
 
+    def save(self, *args, **kwargs):
+        self.email_normalized = self.normalize_username_value(self.email)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'email' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'email_normalized'}
+        super(AbstractEmailUser, self).save(*args, **kwargs)
+
 
 class EmailUser(AbstractEmailUser):
     objects = UserManager()
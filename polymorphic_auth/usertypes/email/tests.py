@@ -2,6 +2,8 @@ from django_webtest import WebTest
 
 from django.core.urlresolvers import reverse
 
+from polymorphic_auth.models import User
+
 from .models import EmailUser
 
 
@@ -30,6 +32,17 @@ class TestEmailUser(WebTest):
         except Exception, ex:
             self.assertTrue('matches existing users' in ex.message)
 
+    def test_cannot_create_user_with_same_email_by_constraint(self):
+        EmailUser.IS_NORMALIZED_USERNAME_UNIQUE = True
+        try:
+            user = EmailUser(email='Superuser@test.com')
+            with self.assertRaises(Exception) as cm:
+                user.save()
+            self.assertTrue('matches existing users' in str(cm.exception))
+            self.assertIsNone(user.pk)
+        finally:
+            del EmailUser.IS_NORMALIZED_USERNAME_UNIQUE
+
     def test_cannot_modify_user_to_have_same_email(self):
         user = EmailUser.objects.create(email='another@test.com')
         # Cannot create a user with an exactly matching email
@@ -54,6 +67,48 @@ class TestEmailUser(WebTest):
         self.assertEqual('Sir', reloaded_superuser.first_name)
         self.assertEqual('Test', reloaded_superuser.last_name)
 
+    def test_normalized_email_is_stored_on_save(self):
+        user = EmailUser.objects.create(email='Mixed.Case@Test.com')
+        self.assertEqual('mixed.case@test.com', user.email_normalized)
+        user.email = 'Other@Test.com'
+        user.save(update_fields=['email'])
+        self.assertEqual(
+            'other@test.com',
+            EmailUser.objects.get(pk=user.pk).email_normalized)
+
+    def test_get_by_natural_key_ignores_case(self):
+        self.assertEqual(
+            self.superuser,
+            EmailUser.objects.get_by_natural_key('SuperUser@Test.com'))
+
+    def test_bulk_create_users(self):
+        created, skipped = EmailUser.objects.bulk_create_users([
+            {'email': 'one@test.com', 'password': 'abc123'},
+            {'email': 'Two@test.com', 'first_name': 'Two'},
+            {'email': 'two@test.com'},
+            {'email': 'SUPERUSER@test.com'},
+        ], batch_size=2)
+        self.assertEqual((2, 2), (created, skipped))
+        one = EmailUser.objects.get_by_natural_key('one@test.com')
+        self.assertTrue(one.check_password('abc123'))
+        two = User.objects.get(emailuser__email='Two@test.com')
+        self.assertTrue(isinstance(two, EmailUser))
+        self.assertEqual('Two', two.first_name)
+        self.assertFalse(two.has_usable_password())
+
+    def test_bulk_create_users_with_same_password_hash(self):
+        hasher = 'django.contrib.auth.hashers.UnsaltedMD5PasswordHasher'
+        with self.settings(PASSWORD_HASHERS=[hasher]):
+            created, skipped = EmailUser.objects.bulk_create_users([
+                {'email': 'one@test.com', 'password': 'abc123'},
+                {'email': 'two@test.com', 'password': 'abc123'},
+            ])
+            self.assertEqual((2, 0), (created, skipped))
+            for email in ('one@test.com', 'two@test.com'):
+                user = User.objects.get(emailuser__email=email)
+                self.assertEqual(email, user.email)
+                self.assertTrue(user.check_password('abc123'))
+
     def test_cannot_create_user_with_same_email_in_admin(self):
         response = self.app.get(
             reverse('admin:polymorphic_auth_user_add'),
@@ -26,7 +26,7 @@ setuptools.setup(
                 'abstract and mixin classes to create your own.',
     long_description=locals().get('long_description', ''),
     license='MIT',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks']),
     include_package_data=True,
     install_requires=[
         'Django',